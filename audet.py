@@ -1,15 +1,32 @@
 import sys
 import os
+import argparse
 import json
 import csv
+import struct
+import re
+import time
+import bisect
+import hashlib
+import tracemalloc
 import librosa
 import numpy as np
 import matplotlib.pyplot as plt
 from essentia.standard import MonoLoader, KeyExtractor
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
 import webbrowser
 from datetime import datetime
 
+try:
+    import mutagen
+    from mutagen.id3 import ID3, TBPM, TKEY
+    from mutagen.mp4 import MP4, MP4FreeForm
+except ImportError:  # Tag support is optional
+    mutagen = None
+
 # Camelot wheel mapping
 CAMELOT_MAP = {
     'C major': '8B', 'G major': '9B', 'D major': '10B', 'A major': '11B', 'E major': '12B',
@@ -28,6 +45,259 @@ MOODS = {
     'dark': ['dark', 'mysterious', 'intense', 'dramatic']
 }
 
+# File types picked up when scanning folders
+AUDIO_EXTENSIONS = {'.mp3', '.wav', '.flac', '.ogg', '.m4a'}
+
+# Krumhansl-Kessler key profiles, used for batched chroma key estimation
+PITCH_CLASSES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+# Clip (samples/loops) mode settings
+CLIP_SR = 22050
+CLIP_MAX_DURATION = 30.0
+CLIP_BATCH_SIZE = 32
+CLIP_HOP_LENGTH = 512
+
+# Sliding window used for key-change detection
+KEY_WINDOW_SECONDS = 4.0
+KEY_HOP_SECONDS = 2.0
+
+# Rough peak bytes held per input sample while analyzing a whole track:
+# the float32 signal plus the largest STFT intermediates alive at once
+ANALYSIS_BYTES_PER_SAMPLE = 48
+
+# Shortest chunk used when a track has to be analyzed piecewise
+MIN_CHUNK_SECONDS = 30.0
+
+# Points drawn in waveform previews
+WAVEFORM_POINTS = 4000
+
+# Duplicate detection: a chroma fingerprint over a short excerpt
+FINGERPRINT_INDEX = 'fingerprints.json'
+FINGERPRINT_SR = 11025
+FINGERPRINT_HOP = 2048
+FINGERPRINT_SECONDS = 20.0
+FINGERPRINT_OFFSET = 30.0
+FINGERPRINT_MAX_SHIFT = 2
+FINGERPRINT_DURATION_TOLERANCE = 1.0
+FINGERPRINT_MATCH_BER = 0.3
+
+# Fast mode: estimate tempo/key from a few excerpts, escalate when unsure
+FAST_EXCERPT_SECONDS = 30.0
+FAST_EXCERPT_POSITIONS = (0.2, 0.5, 0.8)
+FAST_MIN_DURATION = 120.0
+FAST_TEMPO_TOLERANCE = 0.04
+FAST_MIN_KEY_STRENGTH = 0.6
+
+# Playlist ordering: local search budget and energy-curve handling
+ORDER_TIME_BUDGET = 2.0
+ORDER_CURVE_WEIGHT = 1.0
+ORDER_TWO_OPT_WINDOW = 200
+ORDER_OR_OPT_LENGTHS = (1, 2, 3)
+ENERGY_CURVES = ('rising', 'falling', 'peak', 'flat')
+
+# Transition cues: phrase length in beats and how many cues to keep
+CUE_PHRASE_BEATS = 32
+CUE_TOP_K = 3
+
+# Trusted tags: policies for using existing BPM/key tags
+TAG_POLICIES = ('skip', 'verify')
+MP4_KEY_TAG = '----:com.apple.iTunes:initialkey'
+
+# Library report: one offline index page plus lazily loaded per-track data
+REPORT_PAGE_SIZE = 100
+REPORT_MAX_POINTS = 200
+
+LIBRARY_REPORT_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Audet Library Report</title>
+<style>
+    body { font-family: Arial, sans-serif; margin: 20px; }
+    table { border-collapse: collapse; width: 100%; }
+    th, td { padding: 4px 8px; border-bottom: 1px solid #ddd; text-align: left; }
+    th { cursor: pointer; background: #f0f0f0; }
+    tr.track { cursor: pointer; }
+    tr.track:hover { background: #f7f7f7; }
+    td.details { background: #fafafa; }
+    .pager { margin: 10px 0; }
+    .pager button { margin-right: 5px; }
+    svg { display: block; margin: 6px 0; }
+</style>
+</head>
+<body>
+<h1>Audet Library Report</h1>
+<p id="summary"></p>
+<input id="search" type="search" placeholder="Filter by filename, key, mood or genre">
+<div class="pager" id="pager-top"></div>
+<table>
+    <thead><tr id="header"></tr></thead>
+    <tbody id="rows"></tbody>
+</table>
+<div class="pager" id="pager-bottom"></div>
+<script>
+var LIBRARY = __LIBRARY__;
+</script>
+<script>
+(function () {
+    var COLUMNS = ['Filename', 'BPM', 'Key', 'Camelot', 'Mood', 'Genre', 'Energy', 'Confidence'];
+    var PAGE_SIZE = LIBRARY.page_size;
+    var tracks = LIBRARY.tracks;
+    var view = tracks.map(function (_, i) { return i; });
+    var page = 0, sortColumn = -1, sortAsc = true;
+    var chunks = {}, waiting = {};
+
+    // Per-track data arrives as data/tracks-NNNN.js files calling this
+    window.audetData = function (chunk, data) {
+        chunks[chunk] = data;
+        (waiting[chunk] || []).forEach(function (fn) { fn(data); });
+        delete waiting[chunk];
+    };
+
+    function loadChunk(chunk, fn) {
+        if (chunks[chunk]) { fn(chunks[chunk]); return; }
+        if (waiting[chunk]) { waiting[chunk].push(fn); return; }
+        waiting[chunk] = [fn];
+        var script = document.createElement('script');
+        script.src = 'data/tracks-' + ('000' + chunk).slice(-4) + '.js';
+        document.body.appendChild(script);
+    }
+
+    function el(tag, text) {
+        var node = document.createElement(tag);
+        if (text !== undefined) node.textContent = text;
+        return node;
+    }
+
+    function line(times, values, color) {
+        var ns = 'http://www.w3.org/2000/svg', w = 800, h = 120;
+        var svg = document.createElementNS(ns, 'svg');
+        svg.setAttribute('width', w);
+        svg.setAttribute('height', h);
+        if (!times.length) return svg;
+        var tMax = times[times.length - 1] || 1;
+        var vMax = Math.max.apply(null, values) || 1;
+        var points = times.map(function (t, i) {
+            return (t / tMax * (w - 2) + 1).toFixed(1) + ',' + (h - 1 - values[i] / vMax * (h - 2)).toFixed(1);
+        });
+        var path = document.createElementNS(ns, 'polyline');
+        path.setAttribute('points', points.join(' '));
+        path.setAttribute('fill', 'none');
+        path.setAttribute('stroke', color);
+        svg.appendChild(path);
+        return svg;
+    }
+
+    function showDetails(row, index) {
+        var next = row.nextSibling;
+        if (next && next.className === 'detail-row') { next.parentNode.removeChild(next); return; }
+        var detailRow = el('tr'), cell = el('td', 'Loading...');
+        detailRow.className = 'detail-row';
+        cell.className = 'details';
+        cell.colSpan = COLUMNS.length;
+        detailRow.appendChild(cell);
+        row.parentNode.insertBefore(detailRow, row.nextSibling);
+
+        var t = tracks[index];
+        loadChunk(t[8], function (data) {
+            var d = data[t[9]];
+            cell.textContent = '';
+            cell.appendChild(el('div', d.path));
+            if (d.energy[0].length) {
+                cell.appendChild(el('strong', 'Energy'));
+                cell.appendChild(line(d.energy[0], d.energy[1], '#2196F3'));
+            }
+            if (d.key_changes.length) {
+                cell.appendChild(el('strong', 'Key changes'));
+                cell.appendChild(el('div', d.key_changes.map(function (k) {
+                    return k[0].toFixed(0) + 's ' + k[1];
+                }).join('  →  ')));
+            }
+            var moods = Object.keys(d.mood_scores);
+            if (moods.length) {
+                cell.appendChild(el('strong', 'Mood scores'));
+                cell.appendChild(el('div', moods.map(function (m) {
+                    return m + ' ' + d.mood_scores[m].toFixed(2);
+                }).join(', ')));
+            }
+        });
+    }
+
+    function render() {
+        var rows = document.getElementById('rows');
+        rows.textContent = '';
+        var start = page * PAGE_SIZE;
+        view.slice(start, start + PAGE_SIZE).forEach(function (index) {
+            var t = tracks[index], row = el('tr');
+            row.className = 'track';
+            for (var c = 0; c < COLUMNS.length; c++) row.appendChild(el('td', t[c] === null ? '' : t[c]));
+            row.onclick = function () { showDetails(row, index); };
+            rows.appendChild(row);
+        });
+
+        var pages = Math.max(1, Math.ceil(view.length / PAGE_SIZE));
+        ['pager-top', 'pager-bottom'].forEach(function (id) {
+            var pager = document.getElementById(id);
+            pager.textContent = '';
+            var prev = el('button', 'Previous'), next = el('button', 'Next');
+            prev.disabled = page === 0;
+            next.disabled = page >= pages - 1;
+            prev.onclick = function () { page--; render(); };
+            next.onclick = function () { page++; render(); };
+            pager.appendChild(prev);
+            pager.appendChild(next);
+            pager.appendChild(el('span', 'Page ' + (page + 1) + ' of ' + pages + ' (' + view.length + ' tracks)'));
+        });
+    }
+
+    function applyFilter() {
+        var q = document.getElementById('search').value.toLowerCase();
+        view = tracks.map(function (_, i) { return i; }).filter(function (i) {
+            var t = tracks[i];
+            return !q || [t[0], t[2], t[3], t[4], t[5]].join(' ').toLowerCase().indexOf(q) >= 0;
+        });
+        if (sortColumn >= 0) {
+            view.sort(function (a, b) {
+                var x = tracks[a][sortColumn], y = tracks[b][sortColumn];
+                var r = x === y ? 0 : (x === null ? 1 : y === null ? -1 : (x < y ? -1 : 1));
+                return sortAsc ? r : -r;
+            });
+        }
+        page = 0;
+        render();
+    }
+
+    COLUMNS.forEach(function (name, c) {
+        var th = el('th', name);
+        th.onclick = function () {
+            sortAsc = sortColumn === c ? !sortAsc : true;
+            sortColumn = c;
+            applyFilter();
+        };
+        document.getElementById('header').appendChild(th);
+    });
+    document.getElementById('search').oninput = applyFilter;
+    document.getElementById('summary').textContent =
+        tracks.length + ' tracks, generated ' + LIBRARY.generated;
+    render();
+})();
+</script>
+</body>
+</html>
+"""
+
+# Sharded runs: per-shard result files and the library manifest
+SHARD_PATTERN = re.compile(r'analysis\.shard-(\d+)-of-(\d+)\.json$')
+
+# Parallel analysis: shorter tracks don't repay the process pool startup
+PARALLEL_MIN_DURATION = 300.0
+
+# Watch mode: scan interval and how long a file must stay unchanged
+WATCH_POLL_SECONDS = 1.0
+WATCH_SETTLE_SECONDS = 2.0
+
 def get_harmonic_matches(camelot_key):
     """Get harmonically compatible keys based on Camelot wheel"""
     number = int(camelot_key[:-1])
@@ -41,21 +311,329 @@ def get_harmonic_matches(camelot_key):
     ]
     return matches
 
+# Uncompressed formats that can be memory-mapped instead of decoded
+MAPPED_EXTENSIONS = {'.wav', '.wave', '.aif', '.aiff', '.aifc'}
+
+# Frames converted to float per step when reading a mapped file
+MAPPED_CHUNK_FRAMES = 1 << 18
+
+class MappedAudio:
+    """PCM samples memory-mapped from a WAV/AIFF file.
+
+    Slicing returns float32 mono for just the requested frames, so windowed
+    analyzers can take views of the track without converting all of it.
+    """
+
+    def __init__(self, path, offset, frames, channels, sampwidth, sr,
+                 big_endian=False, is_float=False):
+        self.path = path
+        self.sr = sr
+        self.channels = channels
+        self._sampwidth = sampwidth
+        self._big_endian = big_endian
+        self._bias = 0.0
+        self._scale = 1.0
+
+        if sampwidth == 3:
+            # No native 24-bit dtype; keep the raw bytes and assemble on access
+            self._raw = np.memmap(path, dtype=np.uint8, mode='r', offset=offset,
+                                  shape=(frames, channels, 3))
+            self._scale = 1.0 / (1 << 23)
+            return
+
+        order = '>' if big_endian else '<'
+        if is_float:
+            dtype = f'{order}f{sampwidth}'
+        elif sampwidth == 1 and not big_endian:
+            # 8-bit WAV is unsigned, 8-bit AIFF is signed
+            dtype = 'u1'
+            self._bias = -128.0
+            self._scale = 1.0 / 128
+        else:
+            dtype = f'{order}i{sampwidth}'
+            self._scale = 1.0 / (1 << (8 * sampwidth - 1))
+        self._raw = np.memmap(path, dtype=np.dtype(dtype), mode='r', offset=offset,
+                              shape=(frames, channels))
+
+    def __len__(self):
+        return self._raw.shape[0]
+
+    @property
+    def duration(self):
+        return len(self) / self.sr
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError("MappedAudio only supports slicing")
+        start, stop, step = key.indices(len(self))
+        if step != 1:
+            raise ValueError("MappedAudio slices must be contiguous")
+        return self._convert(self._raw[start:max(start, stop)])
+
+    def _convert(self, raw):
+        if self._sampwidth == 3:
+            b = raw.astype(np.int32)
+            if self._big_endian:
+                b = b[..., ::-1]
+            data = b[..., 0] | (b[..., 1] << 8) | (b[..., 2] << 16)
+            data = (data << 8) >> 8  # sign-extend
+        else:
+            data = raw
+
+        samples = data.astype(np.float32)
+        if self._bias:
+            samples += self._bias
+        if self._scale != 1.0:
+            samples *= self._scale
+
+        if self.channels > 1:
+            return samples.mean(axis=1, dtype=np.float32)
+        return np.ascontiguousarray(samples[:, 0])
+
+    def iter_chunks(self, chunk_frames=MAPPED_CHUNK_FRAMES):
+        """Yield (start_frame, float32 mono block) pairs covering the file"""
+        for start in range(0, len(self), chunk_frames):
+            yield start, self[start:start + chunk_frames]
+
+    def to_mono(self):
+        """Convert the whole file to float32 mono, one chunk at a time"""
+        out = np.empty(len(self), dtype=np.float32)
+        for start, block in self.iter_chunks():
+            out[start:start + len(block)] = block
+        return out
+
+def _parse_wav(f, file_size):
+    fmt = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        chunk_id, size = struct.unpack('<4sI', header)
+
+        if chunk_id == b'fmt ':
+            data = f.read(size + (size % 2))
+            tag, channels, sr, _, _, bits = struct.unpack('<HHIIHH', data[:16])
+            if tag == 0xFFFE and size >= 26:  # WAVE_FORMAT_EXTENSIBLE
+                tag = struct.unpack('<H', data[24:26])[0]
+            if tag not in (1, 3):  # PCM or IEEE float
+                return None
+            fmt = (channels, (bits + 7) // 8, sr, tag == 3)
+        elif chunk_id == b'data':
+            if fmt is None:
+                return None
+            channels, sampwidth, sr, is_float = fmt
+            offset = f.tell()
+            # Streamed WAVs may carry a bogus data size; trust the file length
+            size = min(size, file_size - offset)
+            frames = size // (channels * sampwidth)
+            return dict(offset=offset, frames=frames, channels=channels,
+                        sampwidth=sampwidth, sr=sr, big_endian=False,
+                        is_float=is_float)
+        else:
+            f.seek(size + (size % 2), 1)
+
+def _parse_extended(data):
+    """Decode the 80-bit IEEE extended float AIFF uses for the sample rate"""
+    exponent, mantissa = struct.unpack('>HQ', data)
+    sign = -1 if exponent & 0x8000 else 1
+    exponent &= 0x7FFF
+    if exponent == 0 and mantissa == 0:
+        return 0.0
+    return sign * mantissa * 2.0 ** (exponent - 16383 - 63)
+
+def _parse_aiff(f, file_size, is_aifc):
+    fmt = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        chunk_id, size = struct.unpack('>4sI', header)
+
+        if chunk_id == b'COMM':
+            data = f.read(size + (size % 2))
+            channels, frames, bits = struct.unpack('>hIh', data[:8])
+            sr = _parse_extended(data[8:18])
+            big_endian, is_float = True, False
+            if is_aifc:
+                compression = data[18:22]
+                if compression == b'sowt':
+                    big_endian = False
+                elif compression in (b'fl32', b'FL32', b'fl64', b'FL64'):
+                    is_float = True
+                elif compression not in (b'NONE', b'twos'):
+                    return None
+            fmt = (channels, frames, (bits + 7) // 8, int(round(sr)), big_endian, is_float)
+        elif chunk_id == b'SSND':
+            if fmt is None:
+                return None
+            channels, frames, sampwidth, sr, big_endian, is_float = fmt
+            data_offset, _ = struct.unpack('>II', f.read(8))
+            offset = f.tell() + data_offset
+            available = (file_size - offset) // (channels * sampwidth)
+            return dict(offset=offset, frames=min(frames, available), channels=channels,
+                        sampwidth=sampwidth, sr=sr, big_endian=big_endian,
+                        is_float=is_float)
+        else:
+            f.seek(size + (size % 2), 1)
+
+def open_mapped_audio(audio_path):
+    """Memory-map an uncompressed WAV/AIFF file.
+
+    Returns None when the file is not a PCM/float WAV or AIFF that can be
+    mapped, so callers can fall back to a regular decode.
+    """
+    if Path(audio_path).suffix.lower() not in MAPPED_EXTENSIONS:
+        return None
+
+    try:
+        file_size = os.path.getsize(audio_path)
+        with open(audio_path, 'rb') as f:
+            riff = f.read(12)
+            if riff[:4] == b'RIFF' and riff[8:12] == b'WAVE':
+                info = _parse_wav(f, file_size)
+            elif riff[:4] == b'FORM' and riff[8:12] in (b'AIFF', b'AIFC'):
+                info = _parse_aiff(f, file_size, riff[8:12] == b'AIFC')
+            else:
+                info = None
+    except (OSError, struct.error):
+        return None
+
+    if info is None or info['frames'] <= 0 or info['channels'] <= 0:
+        return None
+    if info['is_float'] and info['sampwidth'] not in (4, 8):
+        return None
+    if not info['is_float'] and info['sampwidth'] not in (1, 2, 3, 4):
+        return None
+
+    return MappedAudio(audio_path, **info)
+
+def load_audio(audio_path):
+    """Load a track as float32 mono at its native sample rate.
+
+    PCM WAV/AIFF files are memory-mapped and converted chunk by chunk;
+    everything else goes through librosa. Returns (y, sr, mapped) where
+    mapped is the MappedAudio source or None.
+    """
+    mapped = open_mapped_audio(audio_path)
+    if mapped is not None:
+        return mapped.to_mono(), mapped.sr, mapped
+
+    y, sr = librosa.load(audio_path, sr=None, mono=True, dtype=np.float32)
+    return y, sr, None
+
+def load_segment(audio_path, offset, duration, mapped=None):
+    """Load [offset, offset + duration) seconds of a track as float32 mono"""
+    if mapped is not None:
+        start = int(offset * mapped.sr)
+        return mapped[start:start + int(duration * mapped.sr)]
+
+    y, _ = librosa.load(audio_path, sr=None, mono=True, offset=offset,
+                        duration=duration, dtype=np.float32)
+    return y
+
+def probe_audio(audio_path):
+    """Return (duration, sr) without decoding the track, or None if unknown"""
+    mapped = open_mapped_audio(audio_path)
+    if mapped is not None:
+        return mapped.duration, mapped.sr
+
+    try:
+        return librosa.get_duration(path=audio_path), librosa.get_samplerate(audio_path)
+    except Exception:
+        return None
+
+def current_rss_mb():
+    """Resident set size of this process in MB (0.0 if it can't be read)"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    # Not available without /proc; the high-water mark is the closest thing
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+def reset_peak_rss():
+    """Restart the kernel's RSS high-water mark; False where that's not possible"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2**10
+    except (OSError, ValueError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+def plan_chunk_seconds(audio_path, max_rss_mb):
+    """Pick a chunk length that keeps analysis of a track under max_rss_mb.
+
+    Returns None when the whole track fits in the budget.
+    """
+    info = probe_audio(audio_path)
+    if info is None:
+        return None
+    duration, sr = info
+
+    needed_mb = duration * sr * ANALYSIS_BYTES_PER_SAMPLE / 2**20
+    available_mb = max_rss_mb - current_rss_mb()
+    if needed_mb <= available_mb:
+        return None
+
+    chunk_seconds = max(0.0, available_mb) * 2**20 / (sr * ANALYSIS_BYTES_PER_SAMPLE)
+    # Keep chunk boundaries on the key-change window grid
+    chunk_seconds = KEY_HOP_SECONDS * int(chunk_seconds / KEY_HOP_SECONDS)
+    chunk_seconds = max(MIN_CHUNK_SECONDS, chunk_seconds)
+    print(f"Estimated {needed_mb:.0f} MB exceeds the {max_rss_mb} MB budget; "
+          f"analyzing in {chunk_seconds:.0f} s chunks")
+    return chunk_seconds
+
 def detect_tempo(y, sr):
     tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
     return tempo.item()
 
-def detect_key(filename):
-    audio = MonoLoader(filename=filename)()
-    key, scale, strength = KeyExtractor()(audio)
-    key_str = f"{key} {scale}"
-    camelot = CAMELOT_MAP.get(key_str, "Unknown")
+def _spell_key(key, scale):
+    """CAMELOT_MAP spelling and Camelot code of an Essentia key (which may use flats)"""
+    parsed = parse_key_tag(f"{key} {scale}")
+    return parsed if parsed else (f"{key} {scale}", "Unknown")
+
+def detect_key(filename, y=None, sr=None):
+    """Detect the global key, reusing an already loaded signal when given"""
+    if y is not None:
+        key, scale, strength = KeyExtractor(sampleRate=sr)(y)
+    else:
+        audio = MonoLoader(filename=filename)()
+        key, scale, strength = KeyExtractor()(audio)
+    key_str, camelot = _spell_key(key, scale)
     return key_str, camelot, strength
 
 def detect_key_changes(y, sr, hop_length=512):
-    """Detect key changes over time using sliding window analysis"""
-    window_size = int(4 * sr)
-    hop_samples = int(2 * sr)
+    """Detect key changes over time using sliding window analysis.
+
+    y may be an array or a MappedAudio; only each window is converted.
+    """
+    window_size = int(KEY_WINDOW_SECONDS * sr)
+    hop_samples = int(KEY_HOP_SECONDS * sr)
     
     key_changes = []
     times = []
@@ -63,8 +641,7 @@ def detect_key_changes(y, sr, hop_length=512):
     for i in range(0, len(y) - window_size, hop_samples):
         window = y[i:i + window_size]
         key, scale, strength = KeyExtractor()(window)
-        key_str = f"{key} {scale}"
-        camelot = CAMELOT_MAP.get(key_str, "Unknown")
+        key_str, camelot = _spell_key(key, scale)
         
         time = i / sr
         key_changes.append({
@@ -93,6 +670,10 @@ def estimate_mood(y, sr):
     contrast = np.mean(spectral_contrast)
     rhythm_stability = np.std(rhythm_features)
     
+    return classify_mood(tempo, energy, brightness, contrast, rhythm_stability)
+
+def classify_mood(tempo, energy, brightness, contrast, rhythm_stability):
+    """Map summary audio features to a primary mood and mood scores"""
     if tempo > 130 and energy > 0.7:
         mood = 'energetic'
     elif tempo < 100 and energy < 0.4:
@@ -103,10 +684,10 @@ def estimate_mood(y, sr):
         mood = 'sad'
     
     mood_scores = {
-        'energetic': min(1.0, (tempo/180) * (energy/0.8)),
-        'calm': min(1.0, (1 - tempo/180) * (1 - energy/0.8)),
-        'dark': min(1.0, (contrast/0.8) * (1 - brightness/0.8)),
-        'sad': min(1.0, (1 - contrast/0.8) * (brightness/0.8))
+        'energetic': float(min(1.0, (tempo/180) * (energy/0.8))),
+        'calm': float(min(1.0, (1 - tempo/180) * (1 - energy/0.8))),
+        'dark': float(min(1.0, (contrast/0.8) * (1 - brightness/0.8))),
+        'sad': float(min(1.0, (1 - contrast/0.8) * (brightness/0.8)))
     }
     
     return {
@@ -133,11 +714,14 @@ def analyze_beat_grid(y, sr):
         'tempo': float(tempo.item()) if hasattr(tempo, 'item') else float(tempo),
         'beat_times': beat_times.tolist(),
         'beat_strength': beat_strength.tolist(),
-        'is_quantized': np.std(np.diff(beat_times)) < 0.1
+        'is_quantized': bool(np.std(np.diff(beat_times)) < 0.1)
     }
 
 def analyze_energy_levels(y, sr, segment_length=1.0):
-    """Analyze energy levels throughout the track"""
+    """Analyze energy levels throughout the track.
+
+    y may be an array or a MappedAudio; only each segment is converted.
+    """
     segment_samples = int(segment_length * sr)
     energy_levels = []
     
@@ -166,6 +750,12 @@ def classify_genre(y, sr):
     mfcc_mean = np.mean(mfccs, axis=1)
     mfcc_std = np.std(mfccs, axis=1)
     
+    return classify_genre_features(
+        mfcc_mean, mfcc_std, np.mean(spectral_centroid), np.mean(spectral_rolloff)
+    )
+
+def classify_genre_features(mfcc_mean, mfcc_std, spectral_centroid, spectral_rolloff):
+    """Map MFCC statistics and spectral means to a genre"""
     if np.mean(spectral_centroid) > 0.7 and np.std(mfcc_mean) > 2.0:
         genre = 'electronic'
     elif np.mean(spectral_rolloff) < 0.5 and np.mean(mfcc_mean) < 0:
@@ -181,8 +771,8 @@ def classify_genre(y, sr):
         'features': {
             'mfcc_mean': mfcc_mean.tolist(),
             'mfcc_std': mfcc_std.tolist(),
-            'spectral_centroid': float(np.mean(spectral_centroid)),
-            'spectral_rolloff': float(np.mean(spectral_rolloff))
+            'spectral_centroid': float(spectral_centroid),
+            'spectral_rolloff': float(spectral_rolloff)
         }
     }
 
@@ -212,8 +802,247 @@ def analyze_mix_compatibility(track1, track2):
         ]))
     }
 
-def generate_playlist(tracks, target_mood=None, target_energy=None):
-    """Generate a playlist based on mood and energy flow"""
+def _camelot_parts(camelot_keys):
+    """Split Camelot codes into wheel numbers (0 if unknown) and A/B flags"""
+    numbers = np.zeros(len(camelot_keys), dtype=np.int16)
+    major = np.zeros(len(camelot_keys), dtype=bool)
+    for i, code in enumerate(camelot_keys):
+        if code and code[:-1].isdigit() and code[-1] in 'AB':
+            numbers[i] = int(code[:-1])
+            major[i] = code[-1] == 'B'
+    return numbers, major
+
+def compatibility_matrix(tracks):
+    """Score mix compatibility for every pair of analyzed tracks at once.
+
+    tracks are analysis results (e.g. loaded from analysis.json); nothing is
+    re-analyzed. Tempo compatibility also accepts half/double time, key
+    compatibility follows get_harmonic_matches, and energy uses the average
+    energy. Pairs involving a track without energy levels (fast-mode or tag
+    results) are scored on tempo and key alone. Returns a dict of n x n
+    float32/bool arrays plus the track paths.
+    """
+    tempo = np.array([t['tempo'] for t in tracks], dtype=np.float32)
+    energy = np.array([
+        t.get('energy_levels', {}).get('average_energy', np.nan) for t in tracks
+    ], dtype=np.float32)
+    numbers, major = _camelot_parts([t.get('camelot') for t in tracks])
+
+    a, b = tempo[:, None], tempo[None, :]
+    tempo_diff = np.minimum(np.abs(a - b), np.minimum(np.abs(2 * a - b), np.abs(a - 2 * b)))
+    tempo_compatibility = 1.0 - np.minimum(1.0, tempo_diff / 20.0)
+
+    step = np.abs(numbers[:, None] - numbers[None, :])
+    step = np.minimum(step, 12 - step)
+    same_letter = major[:, None] == major[None, :]
+    known = (numbers[:, None] > 0) & (numbers[None, :] > 0)
+    key_compatibility = known & ((same_letter & (step <= 1)) | (~same_letter & (step == 0)))
+
+    energy_diff = np.abs(energy[:, None] - energy[None, :])
+    energy_known = ~np.isnan(energy_diff)
+    energy_compatibility = np.nan_to_num(1.0 - np.minimum(1.0, energy_diff / 0.5), nan=0.0)
+
+    overall = (tempo_compatibility + key_compatibility + energy_compatibility) / (2.0 + energy_known)
+
+    return {
+        'tracks': [t.get('path', t['filename']) for t in tracks],
+        'tempo_compatibility': tempo_compatibility.astype(np.float32),
+        'key_compatibility': key_compatibility,
+        'energy_compatibility': energy_compatibility.astype(np.float32),
+        'overall_score': overall.astype(np.float32)
+    }
+
+def top_partners(matrix, track_index, k=5):
+    """Return the k best (partner_index, score) pairs for one track of a matrix"""
+    scores = matrix['overall_score'][track_index].copy()
+    scores[track_index] = -np.inf
+    k = min(k, len(scores) - 1)
+    if k <= 0:
+        return []
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best])]
+    return [(int(i), float(scores[i])) for i in best]
+
+def save_compatibility_matrix(matrix, output_path):
+    """Write a matrix as compressed .npz, with scores stored as float16"""
+    np.savez_compressed(
+        output_path,
+        tracks=np.array(matrix['tracks']),
+        tempo_compatibility=matrix['tempo_compatibility'].astype(np.float16),
+        key_compatibility=matrix['key_compatibility'],
+        energy_compatibility=matrix['energy_compatibility'].astype(np.float16),
+        overall_score=matrix['overall_score'].astype(np.float16)
+    )
+
+def load_compatibility_matrix(path):
+    with np.load(path) as data:
+        matrix = {name: data[name] for name in data.files}
+    matrix['tracks'] = matrix['tracks'].tolist()
+    for name in ('tempo_compatibility', 'energy_compatibility', 'overall_score'):
+        matrix[name] = matrix[name].astype(np.float32)
+    return matrix
+
+def energy_curve_targets(curve, n):
+    """Target energy (0-1) for each of n playlist positions.
+
+    curve is one of ENERGY_CURVES or a list of values interpolated over the
+    playlist.
+    """
+    x = np.linspace(0.0, 1.0, n)
+    if curve == 'rising':
+        return x
+    if curve == 'falling':
+        return 1.0 - x
+    if curve == 'peak':
+        return 1.0 - np.abs(2.0 * x - 1.0)
+    if curve == 'flat':
+        return np.full(n, 0.5)
+    points = np.asarray(curve, dtype=float)
+    return np.interp(x, np.linspace(0.0, 1.0, len(points)), points)
+
+def _two_opt_pass(a, cost, penalty, lo, window, deadline):
+    """One pass of segment reversals over the padded path a, in place"""
+    n = len(a) - 2
+    improved = False
+    positional = penalty.any()
+    ramp = np.add.outer(np.arange(window), np.arange(window)) if positional else None
+
+    for i in range(lo, n):
+        if time.monotonic() > deadline:
+            break
+        hi = min(n, i + window - 1)
+        js = np.arange(i + 1, hi + 1)
+        prev, first = a[i - 1], a[i]
+
+        delta = (cost[prev, a[js]] + cost[first, a[js + 1]]
+                 - cost[prev, first] - cost[a[js], a[js + 1]])
+
+        if positional:
+            # Reversing a[i..j] moves the track at i+r to j-r: the new position
+            # penalty is an anti-diagonal sum of the segment's penalty block
+            size = hi - i + 1
+            block = penalty[a[i:hi + 1]][:, i:hi + 1]
+            anti = np.bincount(ramp[:size, :size].ravel(), weights=block.ravel())
+            delta += anti[js - i] - np.cumsum(np.diag(block))[js - i]
+
+        best = int(np.argmin(delta))
+        if delta[best] < -1e-9:
+            j = js[best]
+            a[i:j + 1] = a[i:j + 1][::-1].copy()
+            improved = True
+    return improved
+
+def _or_opt_pass(a, cost, penalty, lo, deadline):
+    """One pass of moving short segments elsewhere in the padded path a"""
+    n = len(a) - 2
+    improved = False
+
+    for length in ORDER_OR_OPT_LENGTHS:
+        i = lo
+        while i + length - 1 <= n:
+            if time.monotonic() > deadline:
+                return improved
+            seg = a[i:i + length].copy()
+            head, tail = seg[0], seg[-1]
+            before, after = a[i - 1], a[i + length]
+            removed = cost[before, after] - cost[before, head] - cost[tail, after]
+            offsets = np.arange(length)
+            old_seg = penalty[seg, i + offsets].sum()
+
+            best_delta, best_move = -1e-9, None
+
+            # Forward: insert after a[p], p in [i+length, n]
+            if i + length <= n:
+                ps = np.arange(i + length, n + 1)
+                edge = cost[a[ps], head] + cost[tail, a[ps + 1]] - cost[a[ps], a[ps + 1]]
+                shift = penalty[a[ps], ps - length] - penalty[a[ps], ps]
+                new_seg = penalty[seg[:, None], ps[None, :] - length + 1 + offsets[:, None]].sum(axis=0)
+                delta = removed + edge + np.cumsum(shift) + new_seg - old_seg
+                k = int(np.argmin(delta))
+                if delta[k] < best_delta:
+                    best_delta, best_move = delta[k], ('forward', ps[k])
+
+            # Backward: insert before a[p], p in [lo, i-1]
+            if i > lo:
+                ps = np.arange(lo, i)
+                edge = cost[a[ps - 1], head] + cost[tail, a[ps]] - cost[a[ps - 1], a[ps]]
+                shift = penalty[a[ps], ps + length] - penalty[a[ps], ps]
+                new_seg = penalty[seg[:, None], ps[None, :] + offsets[:, None]].sum(axis=0)
+                delta = removed + edge + np.cumsum(shift[::-1])[::-1] + new_seg - old_seg
+                k = int(np.argmin(delta))
+                if delta[k] < best_delta:
+                    best_delta, best_move = delta[k], ('backward', ps[k])
+
+            if best_move is None:
+                i += 1
+                continue
+
+            direction, p = best_move
+            if direction == 'forward':
+                a[i:p - length + 1] = a[i + length:p + 1].copy()
+                a[p - length + 1:p + 1] = seg
+            else:
+                a[p + length:i + length] = a[p:i].copy()
+                a[p:p + length] = seg
+            improved = True
+            i += 1
+    return improved
+
+def order_tracks(scores, energy=None, energy_curve=None, opener=None,
+                 time_budget=ORDER_TIME_BUDGET, curve_weight=ORDER_CURVE_WEIGHT):
+    """Order track indices to maximize transition scores, optionally
+    following an energy curve, via greedy start plus 2-opt/Or-opt moves
+    within time_budget seconds"""
+    deadline = time.monotonic() + time_budget
+    scores = np.asarray(scores, dtype=np.float64)
+    n = len(scores)
+    if n == 0:
+        return []
+
+    # A zero-cost sentinel at both ends keeps every move free of edge cases
+    cost = np.zeros((n + 1, n + 1))
+    cost[:n, :n] = 1.0 - (scores + scores.T) / 2.0
+    penalty = np.zeros((n + 1, n + 2))
+    if energy is not None and energy_curve is not None:
+        energy = np.nan_to_num(np.asarray(energy, dtype=np.float64), nan=0.0)
+        span = energy.max() - energy.min()
+        normalized = (energy - energy.min()) / span if span > 0 else np.full(n, 0.5)
+        targets = energy_curve_targets(energy_curve, n)
+        penalty[:n, 1:n + 1] = curve_weight * np.abs(normalized[:, None] - targets[None, :])
+
+    # Greedy nearest neighbour
+    remaining = np.ones(n, dtype=bool)
+    if opener is None:
+        start = int(np.argmin(penalty[:n, 1])) if penalty.any() else 0
+    else:
+        start = opener
+    order = [start]
+    remaining[start] = False
+    for position in range(2, n + 1):
+        step = cost[order[-1], :n] + penalty[:n, position]
+        step[~remaining] = np.inf
+        nxt = int(np.argmin(step))
+        order.append(nxt)
+        remaining[nxt] = False
+
+    a = np.array([n] + order + [n])
+    lo = 2 if opener is not None else 1
+    window = min(n, ORDER_TWO_OPT_WINDOW) if penalty.any() else n
+    while time.monotonic() < deadline:
+        improved = _two_opt_pass(a, cost, penalty, lo, window, deadline)
+        improved = _or_opt_pass(a, cost, penalty, lo, deadline) or improved
+        if not improved:
+            break
+
+    return a[1:-1].tolist()
+
+def generate_playlist(tracks, target_mood=None, target_energy=None, energy_curve=None,
+                      opener=None, time_budget=ORDER_TIME_BUDGET):
+    """Generate a playlist ordered for mixability and energy flow.
+
+    target_energy (0-1) asks for a flat energy curve at that level; opener
+    is the path of the first track, else the best target_mood fit opens.
+    """
     analyzed_tracks = []
     for track in tracks:
         analysis = analyze_audio(track)
@@ -222,31 +1051,188 @@ def generate_playlist(tracks, target_mood=None, target_energy=None):
             'analysis': analysis
         })
     
-    analyzed_tracks.sort(key=lambda x: x['analysis']['mood']['features']['energy'])
+    if not analyzed_tracks:
+        return []
     
-    if target_mood:
-        analyzed_tracks.sort(key=lambda x: x['analysis']['mood']['mood_scores'][target_mood], reverse=True)
+    analyses = [t['analysis'] for t in analyzed_tracks]
+    matrix = compatibility_matrix(analyses)
+    energy = [a.get('energy_levels', {}).get('average_energy', np.nan) for a in analyses]
+    
+    if energy_curve is None and target_energy is not None:
+        energy_curve = [target_energy]
+    
+    if opener is not None:
+        opener_index = tracks.index(opener)
+    elif target_mood:
+        opener_index = int(np.argmax([a['mood']['mood_scores'][target_mood] for a in analyses]))
+    else:
+        opener_index = None
+    
+    order = order_tracks(matrix['overall_score'], energy=energy, energy_curve=energy_curve,
+                         opener=opener_index, time_budget=time_budget)
     
     playlist = []
-    for i in range(len(analyzed_tracks)):
-        if i > 0:
-            compatibility = analyze_mix_compatibility(
-                analyzed_tracks[i-1]['path'],
-                analyzed_tracks[i]['path']
-            )
-            analyzed_tracks[i]['transition_score'] = compatibility['overall_score']
+    for position, index in enumerate(order):
+        if position > 0:
+            transition_score = float(matrix['overall_score'][order[position - 1], index])
+        else:
+            transition_score = 1.0
         
         playlist.append({
-            'track': analyzed_tracks[i]['path'],
-            'analysis': analyzed_tracks[i]['analysis'],
-            'transition_score': analyzed_tracks[i].get('transition_score', 1.0)
+            'track': analyzed_tracks[index]['path'],
+            'analysis': analyzed_tracks[index]['analysis'],
+            'transition_score': transition_score
         })
     
     return playlist
 
+def stretch_ratio(tempo_out, tempo_in):
+    """Playback rate for the incoming track to match the outgoing tempo,
+    folding half/double time to the ratio closest to 1. None if either
+    tempo is unknown (zero, e.g. no beats were detected)."""
+    if not (tempo_out > 0 and tempo_in > 0):
+        return None
+    ratio = tempo_out / tempo_in
+    return min((ratio, ratio * 2.0, ratio / 2.0), key=lambda r: abs(np.log2(r)))
+
+def _has_beat_profiles(analysis):
+    return 'beat_grid' in analysis and 'energy_levels' in analysis
+
+def _beat_profiles(analysis):
+    """Per-beat feature rows (energy, beat strength), z-scored per feature"""
+    beat_times = np.asarray(analysis['beat_grid']['beat_times'], dtype=np.float64)
+    strength = np.asarray(analysis['beat_grid']['beat_strength'], dtype=np.float64)
+    segments = analysis['energy_levels']['segments']
+    seg_times = np.array([s['time'] for s in segments], dtype=np.float64)
+    seg_energy = np.array([s['energy'] for s in segments], dtype=np.float64)
+    energy = np.interp(beat_times, seg_times + 0.5, seg_energy) if len(segments) else np.zeros(len(beat_times))
+
+    profiles = np.stack([energy, strength[:len(beat_times)]])
+    profiles -= profiles.mean(axis=1, keepdims=True)
+    profiles /= np.maximum(profiles.std(axis=1, keepdims=True), 1e-9)
+    return beat_times, profiles
+
+def _fold_beats(times, profiles, step):
+    """Merge every step consecutive beats into one, putting a double-time
+    track on its partner's beat grid"""
+    if step == 1:
+        return times, profiles
+    n = len(times) // step * step
+    return times[:n:step], profiles[:, :n].reshape(len(profiles), -1, step).mean(axis=2)
+
+def _sliding_correlation(signal, templates):
+    """Pearson correlation of each template against every window of signal.
+
+    templates is (m, L); returns (m, len(signal) - L + 1). All offsets are
+    scored at once with one FFT per template.
+    """
+    length = templates.shape[1]
+    n_fft = 1 << int(np.ceil(np.log2(len(signal) + length - 1)))
+
+    templates = templates - templates.mean(axis=1, keepdims=True)
+    templates /= np.maximum(np.linalg.norm(templates, axis=1, keepdims=True), 1e-9)
+    spectrum = np.fft.rfft(signal, n_fft)[None, :] * np.conj(np.fft.rfft(templates, n_fft, axis=1))
+    numerator = np.fft.irfft(spectrum, n_fft, axis=1)[:, :len(signal) - length + 1]
+
+    sums = np.concatenate([[0.0], np.cumsum(signal)])
+    squares = np.concatenate([[0.0], np.cumsum(signal ** 2)])
+    window_sum = sums[length:] - sums[:-length]
+    window_var = (squares[length:] - squares[:-length]) - window_sum ** 2 / length
+    return numerator / np.sqrt(np.maximum(window_var, 1e-9))[None, :]
+
+def find_transition_cues(analysis_out, analysis_in, top_k=CUE_TOP_K, phrase_beats=CUE_PHRASE_BEATS):
+    """Suggest mix-out/mix-in points for playing analysis_in after analysis_out.
+
+    Candidates are phrase boundaries on each beat grid: every phrase_beats
+    beats, mix-out in the second half of the outgoing track and mix-in in
+    the first half of the incoming one. Each pair is scored by how well
+    the per-beat energy and onset profiles correlate over one overlapping
+    phrase. When the tempos pair at half/double time, the faster track's
+    beats are merged in twos so both profiles count the same beats.
+    Every outgoing offset is scored at once with FFT cross-correlation.
+    Works from stored analysis results only. Returns no cues when either
+    tempo is unknown or either result has no beat grid (fast-mode or tag
+    results).
+    """
+    if not (_has_beat_profiles(analysis_out) and _has_beat_profiles(analysis_in)):
+        return []
+    ratio = stretch_ratio(analysis_out['tempo'], analysis_in['tempo'])
+    if ratio is None:
+        return []
+    # 2 when the incoming track is folded to double speed, 0.5 to half
+    fold = ratio * analysis_in['tempo'] / analysis_out['tempo']
+    step_out = 2 if fold < 0.75 else 1
+    step_in = 2 if fold > 1.5 else 1
+
+    times_out, out = _fold_beats(*_beat_profiles(analysis_out), step_out)
+    times_in, inc = _fold_beats(*_beat_profiles(analysis_in), step_in)
+    overlap = min(phrase_beats, len(times_out) // 2, len(times_in) // 2)
+    if overlap < 4:
+        return []
+
+    out_cands = np.arange(0, len(times_out) - overlap + 1, phrase_beats)
+    out_cands = out_cands[out_cands >= len(times_out) // 2]
+    in_cands = np.arange(0, len(times_in) // 2 + 1, phrase_beats)
+    in_cands = in_cands[in_cands + overlap <= len(times_in)]
+    if not len(out_cands) or not len(in_cands):
+        return []
+
+    scores = np.zeros((len(in_cands), len(out_cands)))
+    for feature in range(out.shape[0]):
+        templates = np.stack([inc[feature, i:i + overlap] for i in in_cands])
+        scores += _sliding_correlation(out[feature], templates)[:, out_cands]
+    scores /= out.shape[0]
+
+    top_k = min(top_k, scores.size)
+    best = np.argpartition(-scores.ravel(), top_k - 1)[:top_k]
+    best = best[np.argsort(-scores.ravel()[best])]
+
+    cues = []
+    for flat in best:
+        row, col = np.unravel_index(flat, scores.shape)
+        o, i = int(out_cands[col]), int(in_cands[row])
+        cues.append({
+            'mix_out_beat': o * step_out,
+            'mix_out_time': round(float(times_out[o]), 3),
+            'mix_in_beat': i * step_in,
+            'mix_in_time': round(float(times_in[i]), 3),
+            'overlap_beats': int(overlap * step_out),
+            'score': round(float(scores[row, col]), 3),
+            'stretch_ratio': round(float(ratio), 4)
+        })
+    return cues
+
+def find_crate_cues(tracks, partners=5, top_k=CUE_TOP_K):
+    """Transition cues from every track to its best compatibility partners.
+
+    Only tracks with beat grids take part; fast-mode and tag results are skipped.
+    """
+    tracks = [t for t in tracks if _has_beat_profiles(t)]
+    matrix = compatibility_matrix(tracks)
+    cues = []
+    for index, track in enumerate(tracks):
+        for other, score in top_partners(matrix, index, k=partners):
+            cues.append({
+                'from': matrix['tracks'][index],
+                'to': matrix['tracks'][other],
+                'compatibility': round(score, 3),
+                'cues': find_transition_cues(track, tracks[other], top_k=top_k)
+            })
+    return cues
+
+def waveform_envelope(y, bucket):
+    """Min/max of each bucket of samples, for drawing long signals cheaply"""
+    starts = np.arange(0, len(y), bucket)
+    return starts, np.minimum.reduceat(y, starts), np.maximum.reduceat(y, starts)
+
 def generate_waveform(y, sr, output_path):
+    bucket = max(1, len(y) // WAVEFORM_POINTS)
+    starts, low, high = waveform_envelope(y, bucket)
+    plot_waveform(starts / sr, low, high, output_path)
+
+def plot_waveform(times, low, high, output_path):
     plt.figure(figsize=(12, 4))
-    plt.plot(np.linspace(0, len(y)/sr, len(y)), y)
+    plt.fill_between(times, low, high, linewidth=0.5)
     plt.title('Waveform')
     plt.xlabel('Time (s)')
     plt.ylabel('Amplitude')
@@ -351,103 +1337,1256 @@ def export_analysis_report(track_path, output_format='html'):
         with open(f"{track_path}_report.json", 'w') as f:
             json.dump(analysis, f, indent=2)
 
-def analyze_audio(audio_path):
-    print(f"Analyzing: {audio_path}")
-    
-    # Load audio for analysis
-    y, sr = librosa.load(audio_path, sr=None, mono=True)
-    
-    # Basic analysis
+def downsample_series(times, values, max_points=REPORT_MAX_POINTS):
+    """Average a time series into at most max_points buckets"""
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    if len(times) <= max_points:
+        return times, values
+    edges = np.linspace(0, len(times), max_points + 1).astype(int)
+    starts = edges[:-1]
+    counts = np.diff(edges)
+    return (np.add.reduceat(times, starts) / counts,
+            np.add.reduceat(values, starts) / counts)
+
+def _key_runs(key_changes):
+    """Collapse per-window keys to the points where the key actually changes"""
+    runs = []
+    for change in key_changes:
+        if not runs or runs[-1][1] != change['camelot']:
+            runs.append([round(change['time'], 1), change['camelot']])
+    return runs
+
+def _script_json(data):
+    """JSON that is safe to place inside a <script> element"""
+    return json.dumps(data, separators=(',', ':')).replace('</', '<\\/')
+
+def export_library_report(results, output_dir, page_size=REPORT_PAGE_SIZE,
+                          max_points=REPORT_MAX_POINTS, open_browser=False):
+    """Write one offline HTML report for a whole library of results.
+
+    index.html holds the summary table (paginated, sortable, filterable)
+    and a small built-in chart script, with no external resources.
+    Per-track detail is split into data/tracks-NNNN.js files of page_size
+    tracks each. A file is loaded only when a track from it is expanded.
+    Energy curves are downsampled to max_points and key changes are
+    reduced to the points where the key differs. Returns the index path.
+    """
+    data_dir = os.path.join(output_dir, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+
+    rows = []
+    for chunk, start in enumerate(range(0, len(results), page_size)):
+        details = []
+        for offset, result in enumerate(results[start:start + page_size]):
+            energy_levels = result.get('energy_levels', {})
+            segments = energy_levels.get('segments', [])
+            times, values = downsample_series(
+                [s['time'] for s in segments], [s['energy'] for s in segments], max_points
+            )
+            details.append({
+                'path': result.get('path', result['filename']),
+                'energy': [np.round(times, 1).tolist(), np.round(values, 4).tolist()],
+                'key_changes': _key_runs(result.get('key_changes', [])),
+                'mood_scores': result.get('mood', {}).get('mood_scores', {})
+            })
+
+            average_energy = energy_levels.get('average_energy')
+            rows.append([
+                result['filename'],
+                result['tempo'],
+                result['key'],
+                result['camelot'],
+                result.get('mood', {}).get('primary_mood'),
+                result.get('genre', {}).get('genre'),
+                round(average_energy, 4) if average_energy is not None else None,
+                result['confidence'],
+                chunk,
+                offset
+            ])
+
+        with open(os.path.join(data_dir, f'tracks-{chunk:04d}.js'), 'w') as f:
+            f.write(f"audetData({chunk},{_script_json(details)});\n")
+
+    library = {
+        'generated': datetime.now().isoformat(timespec='seconds'),
+        'page_size': page_size,
+        'tracks': rows
+    }
+    report_path = os.path.join(output_dir, 'index.html')
+    with open(report_path, 'w', encoding='utf-8') as f:
+        f.write(LIBRARY_REPORT_TEMPLATE.replace('__LIBRARY__', _script_json(library)))
+
+    if open_browser:
+        webbrowser.open(f'file://{os.path.abspath(report_path)}')
+    return report_path
+
+def _build_result(audio_path, tempo, key, camelot, confidence, key_changes,
+                  mood_analysis, beat_grid, energy_levels, genre):
+    return {
+        "filename": os.path.basename(audio_path),
+        "path": audio_path,
+        "tempo": round(tempo, 2),
+        "key": key,
+        "camelot": camelot,
+        "confidence": round(confidence, 2),
+        "harmonic_matches": get_harmonic_matches(camelot),
+        "key_changes": key_changes,
+        "mood": mood_analysis,
+        "beat_grid": beat_grid,
+        "energy_levels": energy_levels,
+        "genre": genre,
+        "analysis_time": datetime.now().isoformat()
+    }
+
+def _analyze_full(audio_path):
+    # PCM WAV/AIFF is memory-mapped; the windowed analyzers read it one
+    # window at a time before the whole track is converted
+    mapped = open_mapped_audio(audio_path)
+    if mapped is not None:
+        sr = mapped.sr
+        key_changes = detect_key_changes(mapped, sr)
+        energy_levels = analyze_energy_levels(mapped, sr)
+        y = mapped.to_mono()
+    else:
+        y, sr, _ = load_audio(audio_path)
+        key_changes = detect_key_changes(y, sr)
+        energy_levels = analyze_energy_levels(y, sr)
+
+    # Whole-signal analysis; the key comes from the loaded signal rather
+    # than a second decode by Essentia
+    key, camelot, confidence = detect_key(audio_path, y, sr)
     tempo = detect_tempo(y, sr)
-    key, camelot, confidence = detect_key(audio_path)
-    
-    # Advanced analysis
-    key_changes = detect_key_changes(y, sr)
     mood_analysis = estimate_mood(y, sr)
     beat_grid = analyze_beat_grid(y, sr)
-    energy_levels = analyze_energy_levels(y, sr)
     genre = classify_genre(y, sr)
     
-    # Generate waveform
-    waveform_path = f"{audio_path}_waveform.png"
-    generate_waveform(y, sr, waveform_path)
-    
-    # Get harmonic matches
-    harmonic_matches = get_harmonic_matches(camelot)
+    # Generate waveform; only its envelope is needed, so the signal is
+    # released before the figure is drawn
+    starts, low, high = waveform_envelope(y, max(1, len(y) // WAVEFORM_POINTS))
+    del y
+    plot_waveform(starts / sr, low, high, f"{audio_path}_waveform.png")
     
-    result = {
+    return _build_result(audio_path, tempo, key, camelot, confidence, key_changes,
+                         mood_analysis, beat_grid, energy_levels, genre)
+
+def _run_shared_analyzer(name, shm_name, length, sr, audio_path):
+    """Run one analyzer in a worker process on the signal in shared memory"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        y = np.ndarray((length,), dtype=np.float32, buffer=shm.buf)
+        if name == 'key':
+            result = detect_key(audio_path, y, sr)
+        elif name == 'waveform':
+            result = generate_waveform(y, sr, f"{audio_path}_waveform.png")
+        else:
+            result = SHARED_ANALYZERS[name](y, sr)
+        del y
+        return result
+    finally:
+        shm.close()
+
+# Analyzers that only need (y, sr), slowest first so they start earliest
+SHARED_ANALYZERS = {
+    'key_changes': detect_key_changes,
+    'mood': estimate_mood,
+    'genre': classify_genre,
+    'beat_grid': analyze_beat_grid,
+    'tempo': detect_tempo,
+    'energy_levels': analyze_energy_levels,
+}
+
+def _analyze_parallel(audio_path, workers=None):
+    """Like _analyze_full, but with the analyzers running concurrently over
+    one copy of the signal in shared memory"""
+    mapped = open_mapped_audio(audio_path)
+    if mapped is not None:
+        sr, length = mapped.sr, len(mapped)
+    else:
+        y, sr, _ = load_audio(audio_path)
+        length = len(y)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, length * 4))
+    try:
+        signal = np.ndarray((length,), dtype=np.float32, buffer=shm.buf)
+        if mapped is not None:
+            # Convert straight into the block rather than via a full copy
+            for start, block in mapped.iter_chunks():
+                signal[start:start + len(block)] = block
+        else:
+            signal[:] = y
+            del y
+        del signal
+
+        names = list(SHARED_ANALYZERS) + ['key', 'waveform']
+        workers = workers or min(len(names), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                name: pool.submit(_run_shared_analyzer, name, shm.name, length, sr, audio_path)
+                for name in names
+            }
+            results = {name: future.result() for name, future in futures.items()}
+    finally:
+        shm.close()
+        shm.unlink()
+
+    key, camelot, confidence = results['key']
+    return _build_result(audio_path, results['tempo'], key, camelot, confidence,
+                         results['key_changes'], results['mood'], results['beat_grid'],
+                         results['energy_levels'], results['genre'])
+
+def _pooled_std(means, stds, weights):
+    """Standard deviation of the union of segments given per-segment stats"""
+    mean = np.average(means, axis=0, weights=weights)
+    second_moment = np.average(np.square(stds) + np.square(means), axis=0, weights=weights)
+    return np.sqrt(np.maximum(second_moment - np.square(mean), 0.0))
+
+def _analyze_chunked(audio_path, chunk_seconds):
+    """Analyze a track piecewise so only one chunk is in memory at a time.
+
+    Per-chunk results are merged: beats, energy segments and key changes are
+    concatenated, tempo is the median chunk tempo, the key is the one with
+    the most strength-weighted votes, and mood/genre are re-derived from
+    duration-weighted feature statistics.
+    """
+    duration, sr = probe_audio(audio_path)
+    mapped = open_mapped_audio(audio_path)
+    bucket = max(1, int(duration * sr) // WAVEFORM_POINTS)
+
+    weights, tempos, key_votes, key_strengths = [], [], {}, {}
+    key_changes, beat_times, beat_strength, segments = [], [], [], []
+    mood_features, genre_features = [], []
+    envelope_times, envelope_low, envelope_high = [], [], []
+
+    offset = 0.0
+    while offset < duration:
+        # Read one key-change window past the chunk so windows can straddle it
+        y = load_segment(audio_path, offset, chunk_seconds + KEY_WINDOW_SECONDS, mapped)
+        core = y[:int(chunk_seconds * sr)]
+        if len(core) < sr:
+            break
+        weight = len(core) / sr
+
+        beat_grid = analyze_beat_grid(core, sr)
+        tempos.append(beat_grid['tempo'])
+        beat_times.extend(t + offset for t in beat_grid['beat_times'])
+        beat_strength.extend(beat_grid['beat_strength'])
+
+        key, _, strength = detect_key(audio_path, core, sr)
+        key_votes[key] = key_votes.get(key, 0.0) + float(strength) * weight
+        key_strengths.setdefault(key, []).append(float(strength))
+
+        for change in detect_key_changes(y, sr):
+            if change['time'] < chunk_seconds:
+                key_changes.append(dict(change, time=change['time'] + offset))
+
+        mood_features.append(estimate_mood(core, sr)['features'])
+        genre_features.append(classify_genre(core, sr)['features'])
+        for segment in analyze_energy_levels(core, sr)['segments']:
+            segments.append(dict(segment, time=segment['time'] + offset))
+
+        starts, low, high = waveform_envelope(core, bucket)
+        envelope_times.append(starts / sr + offset)
+        envelope_low.append(low)
+        envelope_high.append(high)
+
+        weights.append(weight)
+        offset += chunk_seconds
+        del y, core
+
+    tempo = float(np.median(tempos))
+    key = max(key_votes, key=key_votes.get)
+    camelot = CAMELOT_MAP.get(key, "Unknown")
+    confidence = float(np.mean(key_strengths[key]))
+
+    mood_analysis = classify_mood(
+        tempo,
+        np.average([f['energy'] for f in mood_features], weights=weights),
+        np.average([f['brightness'] for f in mood_features], weights=weights),
+        np.average([f['contrast'] for f in mood_features], weights=weights),
+        np.average([f['rhythm_stability'] for f in mood_features], weights=weights)
+    )
+
+    mfcc_means = np.array([f['mfcc_mean'] for f in genre_features])
+    mfcc_stds = np.array([f['mfcc_std'] for f in genre_features])
+    genre = classify_genre_features(
+        np.average(mfcc_means, axis=0, weights=weights),
+        _pooled_std(mfcc_means, mfcc_stds, weights),
+        np.average([f['spectral_centroid'] for f in genre_features], weights=weights),
+        np.average([f['spectral_rolloff'] for f in genre_features], weights=weights)
+    )
+
+    beat_grid = {
+        'tempo': tempo,
+        'beat_times': beat_times,
+        'beat_strength': beat_strength,
+        'is_quantized': bool(np.std(np.diff(beat_times)) < 0.1) if len(beat_times) > 1 else False
+    }
+    energy_levels = {
+        'segments': segments,
+        'average_energy': float(np.mean([s['energy'] for s in segments])),
+        'energy_variance': float(np.var([s['energy'] for s in segments]))
+    }
+
+    plot_waveform(
+        np.concatenate(envelope_times), np.concatenate(envelope_low),
+        np.concatenate(envelope_high), f"{audio_path}_waveform.png"
+    )
+
+    return _build_result(audio_path, tempo, key, camelot, confidence, key_changes,
+                         mood_analysis, beat_grid, energy_levels, genre)
+
+def estimate_fast(audio_path, duration, sr):
+    """Estimate tempo and key from a few excerpts instead of the whole track.
+
+    Returns None when the excerpts disagree on tempo or key, or the key
+    strength is low, so the caller can escalate to full analysis.
+    """
+    mapped = open_mapped_audio(audio_path)
+    excerpts = []
+    for position in FAST_EXCERPT_POSITIONS:
+        offset = max(0.0, position * duration - FAST_EXCERPT_SECONDS / 2)
+        y = load_segment(audio_path, offset, FAST_EXCERPT_SECONDS, mapped)
+        key, camelot, strength = detect_key(audio_path, y, sr)
+        excerpts.append({
+            'offset': round(offset, 2),
+            'tempo': detect_tempo(y, sr),
+            'key': key,
+            'camelot': camelot,
+            'confidence': float(strength)
+        })
+        del y
+
+    tempos = [e['tempo'] for e in excerpts]
+    tempo = float(np.median(tempos))
+    tempo_agrees = (max(tempos) - min(tempos)) <= FAST_TEMPO_TOLERANCE * tempo
+    key_agrees = len({e['key'] for e in excerpts}) == 1
+    strong = min(e['confidence'] for e in excerpts) >= FAST_MIN_KEY_STRENGTH
+    if not (tempo_agrees and key_agrees and strong):
+        return None
+
+    key, camelot = excerpts[0]['key'], excerpts[0]['camelot']
+    confidence = float(np.mean([e['confidence'] for e in excerpts]))
+    return {
         "filename": os.path.basename(audio_path),
+        "path": audio_path,
         "tempo": round(tempo, 2),
         "key": key,
         "camelot": camelot,
         "confidence": round(confidence, 2),
-        "harmonic_matches": harmonic_matches,
-        "key_changes": key_changes,
-        "mood": mood_analysis,
-        "beat_grid": beat_grid,
-        "energy_levels": energy_levels,
-        "genre": genre,
+        "harmonic_matches": get_harmonic_matches(camelot),
+        "excerpts": excerpts,
+        "analysis_mode": 'fast',
         "analysis_time": datetime.now().isoformat()
     }
+
+def _require_mutagen():
+    if mutagen is None:
+        raise ImportError("Reading and writing tags requires mutagen: pip install mutagen")
+
+_FLATS = {'Cb': 'B', 'Db': 'C#', 'Eb': 'D#', 'Fb': 'E', 'Gb': 'F#', 'Ab': 'G#', 'Bb': 'A#',
+          'E#': 'F', 'B#': 'C'}
+_CAMELOT_KEYS = {camelot: key for key, camelot in CAMELOT_MAP.items()}
+
+def parse_key_tag(value):
+    """Normalize a key tag to a (key, camelot) pair in CAMELOT_MAP notation.
+
+    Understands Camelot (8A), Open Key (1m/1d) and musical spellings
+    (Am, A minor, Bbm, C#, Db major). Returns None for anything else,
+    including the ID3 off-key marker 'o'.
+    """
+    value = value.strip().replace('\u266f', '#').replace('\u266d', 'b')
+
+    match = re.fullmatch(r'0?(1[0-2]|[1-9])\s*([ABab])', value)
+    if match:
+        camelot = f"{int(match.group(1))}{match.group(2).upper()}"
+        return _CAMELOT_KEYS[camelot], camelot
+
+    match = re.fullmatch(r'0?(1[0-2]|[1-9])\s*([dmDM])', value)
+    if match:
+        number = (int(match.group(1)) + 6) % 12 + 1
+        camelot = f"{number}{'B' if match.group(2).lower() == 'd' else 'A'}"
+        return _CAMELOT_KEYS[camelot], camelot
+
+    match = re.fullmatch(r'([A-Ga-g])([#b]?)\s*(m|min|minor|maj|major)?', value, re.IGNORECASE)
+    if not match:
+        return None
+    root = match.group(1).upper() + match.group(2).lower()
+    root = _FLATS.get(root, root)
+    quality = (match.group(3) or '').lower()
+    # A bare 'm' is minor; 'M' on its own is sometimes used for major
+    minor = quality in ('min', 'minor') or match.group(3) == 'm'
+    key = f"{root} {'minor' if minor else 'major'}"
+    return key, CAMELOT_MAP[key]
+
+def _first_text(tags, *names):
+    for name in names:
+        if name in tags:
+            value = tags[name]
+            if hasattr(value, 'text'):
+                value = value.text
+            if isinstance(value, (list, tuple)):
+                value = value[0] if value else None
+            if isinstance(value, bytes):
+                value = value.decode('utf-8', 'replace')
+            if value is not None:
+                return str(value)
+    return None
+
+def read_tags(audio_path):
+    """Read BPM and key tags (ID3, Vorbis or MP4) without decoding audio.
+
+    Returns a dict with 'tempo', 'key' and 'camelot', each None if the tag
+    is missing or unusable.
+    """
+    _require_mutagen()
+    audio = mutagen.File(audio_path)
+    tags = audio.tags if audio is not None and audio.tags is not None else {}
+
+    bpm = _first_text(tags, 'TBPM', 'BPM', 'bpm', 'tmpo', 'TEMPO', 'tempo')
+    key = _first_text(tags, 'TKEY', 'INITIALKEY', 'initialkey', 'KEY', 'key', MP4_KEY_TAG)
+
+    try:
+        tempo = float(bpm) if bpm is not None else None
+    except ValueError:
+        tempo = None
+    parsed = parse_key_tag(key) if key else None
+
+    return {
+        'tempo': tempo if tempo and tempo > 0 else None,
+        'key': parsed[0] if parsed else None,
+        'camelot': parsed[1] if parsed else None
+    }
+
+def _tempo_agrees(a, b, tolerance=FAST_TEMPO_TOLERANCE):
+    ratio = stretch_ratio(a, b)
+    return ratio is not None and abs(np.log2(ratio)) <= np.log2(1.0 + tolerance)
+
+def estimate_from_tags(audio_path, policy):
+    """Build a result from trusted BPM/key tags, or None to fall back.
+
+    With policy 'skip' the tags are used as they are. With 'verify' one
+    excerpt from the middle of the track is analyzed, and the tags are used
+    only if its tempo (allowing half/double time) and key agree with them.
+    """
+    _require_mutagen()
+    try:
+        tags = read_tags(audio_path)
+    except mutagen.MutagenError as e:
+        print(f"Unreadable tags ({str(e)}); analyzing")
+        return None
+    if tags['tempo'] is None or tags['key'] is None:
+        return None
+
+    mode = 'tags'
+    if policy == 'verify':
+        info = probe_audio(audio_path)
+        if info is None:
+            return None
+        duration, sr = info
+        offset = max(0.0, duration / 2 - FAST_EXCERPT_SECONDS / 2)
+        y = load_segment(audio_path, offset, FAST_EXCERPT_SECONDS, open_mapped_audio(audio_path))
+        key, camelot, _ = detect_key(audio_path, y, sr)
+        tempo = detect_tempo(y, sr)
+        del y
+        if camelot != tags['camelot'] or not _tempo_agrees(tempo, tags['tempo']):
+            print(f"Tags disagree with spot check ({tempo:.1f} BPM, {key}); analyzing")
+            return None
+        mode = 'tags-verified'
+
+    return {
+        "filename": os.path.basename(audio_path),
+        "path": audio_path,
+        "tempo": round(tags['tempo'], 2),
+        "key": tags['key'],
+        "camelot": tags['camelot'],
+        "confidence": 1.0,
+        "harmonic_matches": get_harmonic_matches(tags['camelot']),
+        "analysis_mode": mode,
+        "analysis_time": datetime.now().isoformat()
+    }
+
+def _key_tag_text(key):
+    """Spell a CAMELOT_MAP key the way ID3 TKEY expects (Am, C#, ...)"""
+    root, scale = key.split()
+    return f"{root}m" if scale == 'minor' else root
+
+def write_tags(results):
+    """Write analyzed tempo and key back into each file's tags.
+
+    Results that came from tags are skipped. Returns the number of files
+    written.
+    """
+    _require_mutagen()
+    written = 0
+    for result in results:
+        path = result.get('path')
+        if not path or result.get('analysis_mode', '').startswith('tags') or result.get('camelot') == 'Unknown':
+            continue
+        bpm = f"{result['tempo']:.2f}".rstrip('0').rstrip('.')
+        key = _key_tag_text(result['key'])
+        try:
+            audio = mutagen.File(path)
+            if audio is None:
+                continue
+            if audio.tags is None:
+                audio.add_tags()
+            if isinstance(audio.tags, ID3):
+                audio.tags.add(TBPM(encoding=3, text=[bpm]))
+                audio.tags.add(TKEY(encoding=3, text=[key]))
+            elif isinstance(audio, MP4):
+                audio.tags['tmpo'] = [int(round(result['tempo']))]
+                audio.tags[MP4_KEY_TAG] = [MP4FreeForm(key.encode('utf-8'))]
+            else:
+                audio.tags['BPM'] = [bpm]
+                audio.tags['INITIALKEY'] = [key]
+            audio.save()
+            written += 1
+        except Exception as e:
+            print(f"Error writing tags to {path}: {str(e)}")
+    return written
+
+def analyze_audio(audio_path, max_rss_mb=None, fast=False, trust_tags=None, parallel=False,
+                  workers=None):
+    """Run the analysis pipeline on one track.
+
+    max_rss_mb switches large tracks to chunked analysis, fast tries excerpt
+    estimates first, trust_tags ('skip'/'verify') uses existing tags, and
+    parallel spreads the analyzers over worker processes.
+    """
+    print(f"Analyzing: {audio_path}")
+    
+    if trust_tags:
+        result = estimate_from_tags(audio_path, trust_tags)
+        if result is not None:
+            print(f"Tagged Tempo: {result['tempo']} BPM, Key: {result['key']} "
+                  f"(Camelot: {result['camelot']}, {result['analysis_mode']})")
+            return result
+    
+    mode = 'full'
+    if fast:
+        info = probe_audio(audio_path)
+        if info is not None and info[0] >= FAST_MIN_DURATION:
+            result = estimate_fast(audio_path, *info)
+            if result is not None:
+                print(f"Estimated Tempo: {result['tempo']} BPM (fast)")
+                print(f"Estimated Key: {result['key']} (Confidence: {result['confidence']}, Camelot: {result['camelot']})")
+                return result
+            print("Excerpts disagree or key strength is low; escalating to full analysis")
+            mode = 'escalated'
+    
+    # Peak RSS is always reported; tracing slows every allocation, so the
+    # traced peak is only taken under a budget
+    rss_reset = reset_peak_rss()
+    rss_before = peak_rss_mb()
+    started_tracing = bool(max_rss_mb) and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    if max_rss_mb:
+        tracemalloc.reset_peak()
+    traced_peak = None
+    try:
+        chunk_seconds = plan_chunk_seconds(audio_path, max_rss_mb) if max_rss_mb else None
+        if chunk_seconds:
+            result = _analyze_chunked(audio_path, chunk_seconds)
+        else:
+            result = _analyze_parallel(audio_path, workers) if parallel else _analyze_full(audio_path)
+        if max_rss_mb:
+            traced_peak = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+    
+    result['analysis_mode'] = mode
+    # Without a reset the lifetime high-water mark only shows this file's growth
+    peak = peak_rss_mb() if rss_reset else max(0.0, peak_rss_mb() - rss_before)
+    result['memory'] = {
+        'peak_mb': round(peak, 1),
+        'traced_peak_mb': traced_peak,
+        'rss_mb': round(current_rss_mb(), 1),
+        'chunk_seconds': chunk_seconds
+    }
     
     print(f"Estimated Tempo: {result['tempo']} BPM")
     print(f"Estimated Key: {result['key']} (Confidence: {result['confidence']}, Camelot: {result['camelot']})")
     print(f"Primary Mood: {result['mood']['primary_mood']}")
     print(f"Genre: {result['genre']['genre']}")
     print(f"Key Changes: {len(result['key_changes'])} detected")
+    memory = result['memory']
+    traced = f", traced {traced_peak} MB" if traced_peak is not None else ""
+    print(f"Peak Memory: {memory['peak_mb']} MB RSS{traced} (now {memory['rss_mb']} MB)")
     
     return result
 
-def process_folder(folder_path):
+def compute_fingerprint(audio_path):
+    """Fingerprint a track from a short excerpt.
+
+    Each chroma frame becomes an 11-bit code: the sign of the change over
+    time of the energy differences between neighbouring pitch classes.
+    This survives re-encoding and renaming. Returns None if the track
+    can't be probed.
+    """
+    info = probe_audio(audio_path)
+    if info is None:
+        return None
+    duration, _ = info
+
+    # Offset varies smoothly with duration so near-identical lengths agree
+    offset = min(FINGERPRINT_OFFSET, max(0.0, (duration - FINGERPRINT_SECONDS) / 2))
+    y, _ = librosa.load(audio_path, sr=FINGERPRINT_SR, mono=True, offset=offset,
+                        duration=FINGERPRINT_SECONDS, dtype=np.float32)
+    chroma = librosa.feature.chroma_stft(y=y, sr=FINGERPRINT_SR, n_fft=4096,
+                                         hop_length=FINGERPRINT_HOP)
+
+    bits = np.diff(np.diff(chroma, axis=0), axis=1) > 0
+    codes = (bits.astype(np.uint16) << np.arange(bits.shape[0], dtype=np.uint16)[:, None]).sum(
+        axis=0, dtype=np.uint16)
+    return {'duration': float(duration), 'codes': codes}
+
+_POPCOUNT = np.array([bin(i).count('1') for i in range(1 << 11)], dtype=np.uint8)
+
+def fingerprint_distance(a, b, max_shift=FINGERPRINT_MAX_SHIFT):
+    """Lowest bit error rate between two fingerprints over small frame shifts"""
+    best = 1.0
+    for shift in range(-max_shift, max_shift + 1):
+        x = a[shift:] if shift >= 0 else a
+        y = b if shift >= 0 else b[-shift:]
+        n = min(len(x), len(y))
+        if n == 0:
+            continue
+        errors = _POPCOUNT[x[:n] ^ y[:n]].sum(dtype=np.int64)
+        best = min(best, errors / (11 * n))
+    return best
+
+class FingerprintIndex:
+    """Persistent map from fingerprints to already analyzed recordings.
+
+    Entries are kept sorted by duration, so a lookup only compares against
+    tracks of about the same length.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._by_duration = []
+
+    @classmethod
+    def load(cls, path):
+        index = cls(path)
+        if os.path.exists(path):
+            with open(path) as f:
+                for entry in json.load(f):
+                    entry['codes'] = np.frombuffer(bytes.fromhex(entry['codes']), dtype='<u2')
+                    index._insert(entry)
+        return index
+
+    def save(self):
+        entries = [
+            dict(entry, codes=entry['codes'].astype('<u2').tobytes().hex())
+            for entry in self.entries.values()
+        ]
+        with open(self.path, 'w') as f:
+            json.dump(entries, f)
+
+    def _insert(self, entry):
+        if entry['path'] in self.entries:
+            old = self.entries[entry['path']]
+            self._by_duration.remove((old['duration'], old['path']))
+        self.entries[entry['path']] = entry
+        bisect.insort(self._by_duration, (entry['duration'], entry['path']))
+
+    def add(self, path, fingerprint, result=None, duplicate_of=None):
+        self._insert({
+            'path': path,
+            'duration': fingerprint['duration'],
+            'codes': fingerprint['codes'],
+            'result': result,
+            'duplicate_of': duplicate_of
+        })
+
+    def find(self, fingerprint):
+        """Return the closest analyzed entry matching fingerprint, or None"""
+        duration = fingerprint['duration']
+        lo = bisect.bisect_left(self._by_duration, (duration - FINGERPRINT_DURATION_TOLERANCE,))
+        hi = bisect.bisect_right(self._by_duration, (duration + FINGERPRINT_DURATION_TOLERANCE, chr(0x10FFFF)))
+
+        best, best_distance = None, FINGERPRINT_MATCH_BER
+        for _, path in self._by_duration[lo:hi]:
+            entry = self.entries[path]
+            if entry['result'] is None:
+                continue
+            distance = fingerprint_distance(fingerprint['codes'], entry['codes'])
+            if distance < best_distance:
+                best, best_distance = entry, distance
+        return best
+
+    def duplicate_groups(self):
+        """Map each analyzed recording to the other files that duplicate it"""
+        groups = {}
+        for entry in self.entries.values():
+            if entry['duplicate_of']:
+                groups.setdefault(entry['duplicate_of'], []).append(entry['path'])
+        return {path: sorted(dupes) for path, dupes in sorted(groups.items())}
+
+def _analyze_with_index(file, index, **analyze_kwargs):
+    """Analyze file unless the index already holds the same recording"""
+    fingerprint = compute_fingerprint(file)
+    match = index.find(fingerprint) if fingerprint is not None else None
+
+    if match is not None and match['path'] == file:
+        print(f"Unchanged since last run: {file}")
+        return match['result']
+    if match is not None:
+        print(f"Duplicate of {match['path']}: {file}")
+        index.add(file, fingerprint, duplicate_of=match['path'])
+        return dict(match['result'], filename=os.path.basename(file), path=file,
+                    duplicate_of=match['path'])
+
+    result = analyze_audio(file, **analyze_kwargs)
+    if fingerprint is not None:
+        index.add(file, fingerprint, result=result)
+    return result
+
+def collect_audio_files(folder_path):
+    """List the audio files under a folder, in a stable order"""
+    return sorted(
+        str(file) for file in Path(folder_path).rglob('*')
+        if file.suffix.lower() in AUDIO_EXTENSIONS
+    )
+
+def _relative_key(file, folder_path):
+    """Path relative to the library root, with forward slashes, so every
+    machine agrees on it whatever the mount point"""
+    return Path(os.path.relpath(file, folder_path)).as_posix()
+
+def shard_of(relative_path, shard_count):
+    """Stable shard number for a library-relative path"""
+    digest = hashlib.sha1(relative_path.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shard_count
+
+def shard_name(shard_index, shard_count):
+    return f"analysis.shard-{shard_index:03d}-of-{shard_count:03d}"
+
+def write_manifest(folder_path, manifest_path):
+    """Freeze the library's file list so every shard works from the same one"""
+    files = [_relative_key(f, folder_path) for f in collect_audio_files(folder_path)]
+    with open(manifest_path, 'w') as f:
+        json.dump({'created': datetime.now().isoformat(), 'files': sorted(files)}, f, indent=2)
+    return files
+
+def load_manifest(manifest_path):
+    with open(manifest_path) as f:
+        return json.load(f)['files']
+
+def process_folder(folder_path, max_rss_mb=None, dedupe=False, index_path=None, fast=False,
+                   trust_tags=None, shard=None, manifest=None):
+    """Analyze every audio file under folder_path.
+
+    max_rss_mb, fast and trust_tags are passed through to analyze_audio.
+    With dedupe, files are fingerprinted first and recordings already in
+    the fingerprint index (by default fingerprints.json in the folder) reuse
+    the stored analysis instead of running the full pipeline.
+
+    shard is an (index, count) pair: only files whose library-relative path
+    hashes to that shard are analyzed, and results record relative_path for
+    merge_shards. manifest is a file list from write_manifest to use
+    instead of scanning the folder.
+    """
     results = []
-    audio_extensions = {'.mp3', '.wav', '.flac', '.ogg', '.m4a'}
+    analyze_kwargs = dict(max_rss_mb=max_rss_mb, fast=fast, trust_tags=trust_tags)
+    index = None
+    if dedupe:
+        default_index = FINGERPRINT_INDEX
+        if shard is not None:
+            # Nodes must not share one index file
+            default_index = f"fingerprints.shard-{shard[0]:03d}-of-{shard[1]:03d}.json"
+        index = FingerprintIndex.load(index_path or os.path.join(folder_path, default_index))
     
-    for file in Path(folder_path).rglob('*'):
-        if file.suffix.lower() in audio_extensions:
-            try:
-                result = analyze_audio(str(file))
-                results.append(result)
-            except Exception as e:
-                print(f"Error processing {file}: {str(e)}")
+    if manifest is not None:
+        files = [os.path.join(folder_path, *rel.split('/')) for rel in load_manifest(manifest)]
+    else:
+        files = collect_audio_files(folder_path)
+    if shard is not None:
+        files = [f for f in files if shard_of(_relative_key(f, folder_path), shard[1]) == shard[0]]
+        print(f"Shard {shard[0]} of {shard[1]}: {len(files)} file(s)")
     
+    for file in files:
+        try:
+            if index is not None:
+                result = _analyze_with_index(file, index, **analyze_kwargs)
+            else:
+                result = analyze_audio(file, **analyze_kwargs)
+            if shard is not None:
+                result = dict(result, relative_path=_relative_key(file, folder_path))
+            results.append(result)
+        except Exception as e:
+            print(f"Error processing {file}: {str(e)}")
+    
+    if index is not None:
+        index.save()
+        groups = index.duplicate_groups()
+        print(f"Duplicate groups: {len(groups)}")
+        for original, dupes in groups.items():
+            print(f"- {original}: {len(dupes)} duplicate(s)")
+    
+    if fast:
+        report_escalations(results)
+    
+    return results
+
+def report_escalations(results):
+    """Print how often fast mode had to fall back to full analysis"""
+    modes = [r.get('analysis_mode') for r in results]
+    attempted = modes.count('fast') + modes.count('escalated')
+    if attempted:
+        escalated = modes.count('escalated')
+        print(f"Escalated to full analysis: {escalated} of {attempted} "
+              f"({100.0 * escalated / attempted:.1f}%)")
+
+def estimate_keys_from_chroma(chroma):
+    """Estimate keys for a batch of mean chroma vectors of shape (n, 12).
+
+    Correlates every clip against all 24 rotated key profiles in one matrix
+    product. Returns a list of (key, camelot, strength) tuples.
+    """
+    templates = np.stack(
+        [np.roll(MAJOR_PROFILE, i) for i in range(12)] +
+        [np.roll(MINOR_PROFILE, i) for i in range(12)]
+    )
+    templates = templates - templates.mean(axis=1, keepdims=True)
+    templates /= np.linalg.norm(templates, axis=1, keepdims=True)
+
+    centered = chroma - chroma.mean(axis=1, keepdims=True)
+    centered /= np.maximum(np.linalg.norm(centered, axis=1, keepdims=True), 1e-12)
+
+    scores = centered @ templates.T
+    best = np.argmax(scores, axis=1)
+
+    keys = []
+    for row, index in enumerate(best):
+        scale = 'major' if index < 12 else 'minor'
+        key_str = f"{PITCH_CLASSES[index % 12]} {scale}"
+        keys.append((key_str, CAMELOT_MAP.get(key_str, "Unknown"), float(scores[row, index])))
+    return keys
+
+def _load_clip(path, sr):
+    """Decode a clip at sr, or return None if it is too long for clip mode"""
+    mapped = open_mapped_audio(path)
+    if mapped is not None and mapped.sr == sr:
+        if mapped.duration >= CLIP_MAX_DURATION:
+            return None
+        return mapped.to_mono()
+
+    y, _ = librosa.load(path, sr=sr, mono=True, duration=CLIP_MAX_DURATION)
+    if len(y) >= int(CLIP_MAX_DURATION * sr):
+        return None
+    return y
+
+def _masked_mean(x, mask, counts):
+    return (x * mask[:, None, :]).sum(axis=-1) / counts[:, None]
+
+def analyze_clip_batch(paths, signals, sr=CLIP_SR):
+    """Analyze a batch of short clips with one vectorized call per feature.
+
+    The signals are zero-padded into a 2-D array; padded frames are masked
+    out of every per-clip statistic.
+    """
+    hop = CLIP_HOP_LENGTH
+    n_fft = 2048
+    lengths = np.array([len(y) for y in signals])
+
+    batch = np.zeros((len(signals), max(lengths.max(), n_fft)), dtype=np.float32)
+    for row, y in enumerate(signals):
+        batch[row, :len(y)] = y
+
+    magnitude = np.abs(librosa.stft(batch, n_fft=n_fft, hop_length=hop))
+    power = magnitude ** 2
+    n_frames = power.shape[-1]
+    mask = np.arange(n_frames)[None, :] < (1 + lengths // hop)[:, None]
+    counts = mask.sum(axis=1)
+
+    log_mel = librosa.power_to_db(librosa.feature.melspectrogram(S=power, sr=sr))
+    onset_env = librosa.onset.onset_strength(S=log_mel, sr=sr)[..., :n_frames] * mask
+    tempi = np.asarray(
+        librosa.feature.tempo(onset_envelope=onset_env, sr=sr, hop_length=hop)
+    ).reshape(len(signals))
+
+    mfcc_mean = _masked_mean(librosa.feature.mfcc(S=log_mel, n_mfcc=20), mask, counts)
+    chroma_mean = _masked_mean(librosa.feature.chroma_stft(S=power, sr=sr), mask, counts)
+    keys = estimate_keys_from_chroma(chroma_mean)
+
+    rms = librosa.feature.rms(S=magnitude, frame_length=n_fft, hop_length=hop)[:, 0, :]
+    rms_mean = (rms * mask).sum(axis=1) / counts
+    rms_var = ((rms - rms_mean[:, None]) ** 2 * mask).sum(axis=1) / counts
+    rms_peak = np.where(mask, rms, 0.0).max(axis=1)
+
+    results = []
+    for row, path in enumerate(paths):
+        key, camelot, strength = keys[row]
+        results.append({
+            "filename": os.path.basename(path),
+            "path": path,
+            "duration": round(lengths[row] / sr, 3),
+            "tempo": round(float(tempi[row]), 2),
+            "key": key,
+            "camelot": camelot,
+            "confidence": round(strength, 2),
+            "harmonic_matches": get_harmonic_matches(camelot) if camelot != "Unknown" else [],
+            "energy_levels": {
+                'average_energy': float(rms_mean[row]),
+                'energy_variance': float(rms_var[row]),
+                'peak': float(rms_peak[row])
+            },
+            "features": {
+                'mfcc_mean': mfcc_mean[row].tolist()
+            },
+            "analysis_time": datetime.now().isoformat()
+        })
     return results
 
-def save_results(results, output_dir):
+def process_clips(paths, sr=CLIP_SR, batch_size=CLIP_BATCH_SIZE):
+    """Analyze many short clips (samples/loops) in length-sorted batches.
+
+    Files longer than CLIP_MAX_DURATION go through the full analyze_audio
+    pipeline instead. Results come back in the order of paths.
+    """
+    by_path = {}
+    clips = []
+
+    for path in paths:
+        try:
+            y = _load_clip(path, sr)
+            if y is None:
+                by_path[path] = analyze_audio(path)
+            else:
+                clips.append((path, y))
+        except Exception as e:
+            print(f"Error processing {path}: {str(e)}")
+
+    # Similar lengths share a batch so little of each batch is padding
+    clips.sort(key=lambda clip: len(clip[1]))
+    for start in range(0, len(clips), batch_size):
+        group = clips[start:start + batch_size]
+        print(f"Analyzing clips {start + 1}-{start + len(group)} of {len(clips)}")
+        try:
+            batch_results = analyze_clip_batch([p for p, _ in group], [y for _, y in group], sr)
+        except Exception as e:
+            print(f"Error processing clip batch: {str(e)}")
+            continue
+        for result in batch_results:
+            by_path[result['path']] = result
+
+    return [by_path[path] for path in paths if path in by_path]
+
+def load_results(path):
+    """Load analysis results saved by save_results (a folder or its JSON file)"""
+    if os.path.isdir(path):
+        path = os.path.join(path, 'analysis.json')
+    with open(path) as f:
+        return json.load(f)
+
+def save_results(results, output_dir, name='analysis'):
+    # Write to temporary files and swap them in, so readers (and watch mode
+    # rewriting these every few seconds) never see a half-written file
+    json_path = os.path.join(output_dir, f'{name}.json')
+    csv_path = os.path.join(output_dir, f'{name}.csv')
+    
     # Save JSON
-    with open(os.path.join(output_dir, 'analysis.json'), 'w') as f:
+    with open(json_path + '.tmp', 'w') as f:
         json.dump(results, f, indent=2)
     
     # Save CSV
-    with open(os.path.join(output_dir, 'analysis.csv'), 'w', newline='') as f:
+    with open(csv_path + '.tmp', 'w', newline='') as f:
         writer = csv.DictWriter(f, fieldnames=[
             'filename', 'tempo', 'key', 'camelot', 'confidence',
-            'primary_mood', 'genre', 'key_changes_count'
+            'primary_mood', 'genre', 'key_changes_count', 'peak_memory_mb',
+            'duplicate_of', 'analysis_mode'
         ])
         writer.writeheader()
         for result in results:
+            # Clip-mode results carry no mood/genre/key-change analysis
             row = {
                 'filename': result['filename'],
                 'tempo': result['tempo'],
                 'key': result['key'],
                 'camelot': result['camelot'],
                 'confidence': result['confidence'],
-                'primary_mood': result['mood']['primary_mood'],
-                'genre': result['genre']['genre'],
-                'key_changes_count': len(result['key_changes'])
+                'primary_mood': result.get('mood', {}).get('primary_mood', ''),
+                'genre': result.get('genre', {}).get('genre', ''),
+                'key_changes_count': len(result.get('key_changes', [])),
+                'peak_memory_mb': result.get('memory', {}).get('peak_mb', ''),
+                'duplicate_of': result.get('duplicate_of', ''),
+                'analysis_mode': result.get('analysis_mode', '')
             }
             writer.writerow(row)
+    
+    os.replace(json_path + '.tmp', json_path)
+    os.replace(csv_path + '.tmp', csv_path)
 
-def main(path):
-    if os.path.isdir(path):
-        results = process_folder(path)
-        save_results(results, path)
-    else:
-        analyze_audio(path)
+def merge_shards(shard_dir, manifest=None):
+    """Combine analysis.shard-*.json files in shard_dir into one result set.
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python audet.py <file.mp3|wav|folder>")
+    Checks that all shards of one run are present and that every result
+    landed in the shard its path hashes to. With a manifest, also reports
+    files that no shard analyzed. Results are deduplicated by
+    relative_path (the newest analysis wins) and ordered by it, so the
+    merged output doesn't depend on which node finished first. Raises
+    ValueError when the shards are inconsistent.
+    """
+    shards = {}
+    for name in sorted(os.listdir(shard_dir)):
+        match = SHARD_PATTERN.match(name)
+        if match:
+            shards[(int(match.group(1)), int(match.group(2)))] = os.path.join(shard_dir, name)
+    if not shards:
+        raise ValueError(f"No shard files found in {shard_dir}")
+
+    counts = {count for _, count in shards}
+    if len(counts) != 1:
+        raise ValueError(f"Shard files from different runs: counts {sorted(counts)}")
+    shard_count = counts.pop()
+    missing = sorted(set(range(shard_count)) - {index for index, _ in shards})
+    if missing:
+        raise ValueError(f"Missing shard(s): {missing}")
+
+    merged = {}
+    for (index, _), path in sorted(shards.items()):
+        for result in load_results(path):
+            key = result['relative_path']
+            if shard_of(key, shard_count) != index:
+                raise ValueError(f"{key} belongs to shard {shard_of(key, shard_count)}, found in shard {index}")
+            if key not in merged or result['analysis_time'] > merged[key]['analysis_time']:
+                merged[key] = result
+
+    if manifest is not None:
+        unanalyzed = sorted(set(load_manifest(manifest)) - set(merged))
+        if unanalyzed:
+            print(f"{len(unanalyzed)} manifest file(s) have no result:")
+            for key in unanalyzed:
+                print(f"- {key}")
+
+    print(f"Merged {len(merged)} result(s) from {shard_count} shard(s)")
+    return [merged[key] for key in sorted(merged)]
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def watch_folder(folder_path, workers=None, poll_interval=WATCH_POLL_SECONDS,
+                 settle_seconds=WATCH_SETTLE_SECONDS, **analyze_kwargs):
+    """Keep a folder's analysis.json/csv up to date as files come and go.
+
+    Files are analyzed once their size and mtime hold for settle_seconds.
+    Runs until interrupted.
+    """
+    workers = workers or os.cpu_count() or 1
+    store = {}
+    if os.path.exists(os.path.join(folder_path, 'analysis.json')):
+        store = {r['path']: r for r in load_results(folder_path) if 'path' in r}
+
+    settling = {}   # path -> (signature, first time seen with it)
+    scheduled = {}  # path -> signature, queued or in flight
+    failed = {}     # path -> signature that failed to analyze
+    suspects = set()  # paths in flight when a worker died
+    queue = []
+    in_flight = {}
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    print(f"Watching {folder_path} with {workers} worker(s); press Ctrl+C to stop")
+    try:
+        while True:
+            now = time.monotonic()
+            changed = False
+            present = set()
+
+            for path in collect_audio_files(folder_path):
+                present.add(path)
+                try:
+                    signature = _file_signature(path)
+                except OSError:
+                    continue
+                if signature in (store.get(path, {}).get('source'), scheduled.get(path), failed.get(path)):
+                    continue
+                seen = settling.get(path)
+                if seen is None or seen[0] != signature:
+                    settling[path] = (signature, now)
+                elif now - seen[1] >= settle_seconds:
+                    del settling[path]
+                    scheduled[path] = signature
+                    queue.append((path, signature))
+
+            for path in [p for p in store if p not in present]:
+                print(f"Removed: {path}")
+                del store[path]
+                changed = True
+            for path in [p for p in settling if p not in present]:
+                del settling[path]
+
+            broken = False
+            while queue and len(in_flight) < 2 * workers:
+                if in_flight and (queue[0][0] in suspects or
+                                  any(p in suspects for p, _ in in_flight.values())):
+                    break
+                try:
+                    future = pool.submit(analyze_audio, queue[0][0], **analyze_kwargs)
+                except BrokenProcessPool:
+                    broken = True
+                    break
+                in_flight[future] = queue.pop(0)
+
+            for future in [f for f in in_flight if f.done()]:
+                path, signature = in_flight[future]
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    continue
+                except Exception as e:
+                    print(f"Error processing {path}: {str(e)}")
+                    failed[path] = signature
+                    result = None
+                del in_flight[future]
+                suspects.discard(path)
+                if scheduled.get(path) == signature:
+                    del scheduled[path]
+                if result is None:
+                    continue
+                result['source'] = signature
+                store[path] = result
+                changed = True
+
+            if broken:
+                # Everything still in flight died with the pool
+                print("A worker process died; restarting the pool")
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = ProcessPoolExecutor(max_workers=workers)
+                alone = len(in_flight) == 1
+                for path, signature in reversed(list(in_flight.values())):
+                    if scheduled.get(path) != signature:
+                        continue  # a newer version is already queued
+                    if alone:
+                        print(f"Error processing {path}: worker process died")
+                        del scheduled[path]
+                        suspects.discard(path)
+                        failed[path] = signature
+                    else:
+                        suspects.add(path)
+                        queue.insert(0, (path, signature))
+                in_flight.clear()
+
+            if changed:
+                save_results([store[p] for p in sorted(store)], folder_path)
+                print(f"Results updated: {len(store)} track(s)")
+
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print("Stopping watch")
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Audet — tempo, key, mood and genre analysis for DJs & producers"
+    )
+    parser.add_argument('path', help="audio file or folder to analyze")
+    parser.add_argument('--clips', action='store_true',
+                        help="treat the folder as short samples/loops and analyze them in batches")
+    parser.add_argument('--batch-size', type=int, default=CLIP_BATCH_SIZE,
+                        help="clips per vectorized batch in --clips mode")
+    parser.add_argument('--fast', action='store_true',
+                        help="estimate tempo/key from excerpts, escalating to full analysis when unsure")
+    parser.add_argument('--dedupe', action='store_true',
+                        help="fingerprint files and reuse results for duplicate recordings")
+    parser.add_argument('--fingerprint-index', default=None,
+                        help="fingerprint index file (default: <folder>/fingerprints.json)")
+    parser.add_argument('--compat-matrix', metavar='OUT', default=None,
+                        help="write the all-pairs mix compatibility matrix (.npz) for a folder "
+                             "or analysis.json, reusing saved results when present")
+    parser.add_argument('--cues', metavar='OUT', default=None,
+                        help="write transition cues (JSON) for each track's best partners, "
+                             "from the folder's analysis.json")
+    parser.add_argument('--watch', action='store_true',
+                        help="keep watching the folder and analyze files as they arrive")
+    parser.add_argument('--parallel', action='store_true',
+                        help="run the analyzers for a single file concurrently")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="worker processes for --watch or --parallel (default: CPU count)")
+    parser.add_argument('--trust-tags', choices=TAG_POLICIES, default=None,
+                        help="use existing BPM/key tags: 'skip' analysis entirely, or 'verify' "
+                             "them against one excerpt first (needs mutagen)")
+    parser.add_argument('--write-tags', action='store_true',
+                        help="write analyzed BPM/key back into the files' tags (needs mutagen)")
+    parser.add_argument('--write-manifest', metavar='FILE', default=None,
+                        help="write the folder's file list to a manifest for sharded runs")
+    parser.add_argument('--manifest', default=None,
+                        help="analyze (or check a merge against) the files in this manifest")
+    parser.add_argument('--shard', default=None, metavar='I/N',
+                        help="analyze only shard I of N (0-based), writing analysis.shard-I-of-N.json")
+    parser.add_argument('--output-dir', default=None,
+                        help="where shard results are written (default: the folder)")
+    parser.add_argument('--merge-shards', action='store_true',
+                        help="merge the shard result files in the given folder into analysis.json")
+    parser.add_argument('--report', metavar='DIR', default=None,
+                        help="write an offline library report (index.html + data/) from the "
+                             "folder's analysis.json")
+    parser.add_argument('--max-rss-mb', type=float, default=None,
+                        help="memory budget per process; larger tracks are analyzed in chunks")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    path = args.path
+    analyze_kwargs = dict(max_rss_mb=args.max_rss_mb, fast=args.fast, trust_tags=args.trust_tags)
+
+    if (args.trust_tags or args.write_tags) and mutagen is None:
+        print("--trust-tags and --write-tags require mutagen: pip install mutagen")
         sys.exit(1)
 
-    path = sys.argv[1]
-    main(path)
+    if args.write_manifest:
+        files = write_manifest(path, args.write_manifest)
+        print(f"Manifest with {len(files)} file(s) written to {args.write_manifest}")
+    elif args.merge_shards:
+        save_results(merge_shards(path, args.manifest), path)
+    elif args.shard:
+        index, count = (int(part) for part in args.shard.split('/'))
+        if not 0 <= index < count:
+            print(f"Invalid shard {args.shard}: expected I/N with 0 <= I < N")
+            sys.exit(1)
+        results = process_folder(path, dedupe=args.dedupe, index_path=args.fingerprint_index,
+                                 shard=(index, count), manifest=args.manifest, **analyze_kwargs)
+        save_results(results, args.output_dir or path, name=shard_name(index, count))
+    elif args.report:
+        report_path = export_library_report(load_results(path), args.report)
+        print(f"Library report written to {report_path}")
+    elif args.compat_matrix:
+        if path.endswith('.json') or os.path.exists(os.path.join(path, 'analysis.json')):
+            results = load_results(path)
+        else:
+            results = process_folder(path, **analyze_kwargs)
+            save_results(results, path)
+        matrix = compatibility_matrix(results)
+        save_compatibility_matrix(matrix, args.compat_matrix)
+        print(f"Compatibility matrix for {len(results)} tracks written to {args.compat_matrix}")
+    elif args.cues:
+        results = load_results(path)
+        with open(args.cues, 'w') as f:
+            json.dump(find_crate_cues(results), f, indent=2)
+        print(f"Transition cues for {sum(map(_has_beat_profiles, results))} tracks written to {args.cues}")
+    elif args.watch:
+        watch_folder(path, workers=args.workers, **analyze_kwargs)
+    else:
+        if os.path.isdir(path):
+            if args.clips:
+                results = process_clips(collect_audio_files(path), batch_size=args.batch_size)
+            else:
+                results = process_folder(path, dedupe=args.dedupe,
+                                         index_path=args.fingerprint_index, **analyze_kwargs)
+            save_results(results, path)
+        else:
+            results = [analyze_audio(path, parallel=args.parallel, workers=args.workers,
+                                     **analyze_kwargs)]
+        
+        if args.write_tags:
+            print(f"Tags written to {write_tags(results)} file(s)")
+
+if __name__ == "__main__":
+    main()
@@ -147,6 +147,19 @@ class AudetGUI:
                 variable=self.mood_var
             ).pack(side=tk.LEFT, padx=10)
         
+        # Energy curve selection
+        curve_frame = ttk.LabelFrame(self.playlist_tab, text="Energy Curve", padding="10")
+        curve_frame.pack(fill=tk.X, pady=10)
+        
+        self.curve_var = tk.StringVar(value="none")
+        for curve in ("none",) + audet.ENERGY_CURVES:
+            ttk.Radiobutton(
+                curve_frame,
+                text=curve.capitalize(),
+                value=curve,
+                variable=self.curve_var
+            ).pack(side=tk.LEFT, padx=10)
+        
         # File selection
         file_frame = ttk.LabelFrame(self.playlist_tab, text="Select Tracks", padding="10")
         file_frame.pack(fill=tk.BOTH, expand=True, pady=10)
@@ -239,6 +252,49 @@ class AudetGUI:
         
         self.mix_text = tk.Text(self.mix_results, height=10, wrap=tk.WORD)
         self.mix_text.pack(fill=tk.BOTH, expand=True)
+        
+        # Best partners from a saved library analysis
+        partners_frame = ttk.LabelFrame(self.mix_tab, text="Best Partners", padding="10")
+        partners_frame.pack(fill=tk.BOTH, expand=True, pady=10)
+        
+        partners_controls = ttk.Frame(partners_frame)
+        partners_controls.pack(fill=tk.X)
+        
+        ttk.Button(
+            partners_controls,
+            text="Load Library",
+            command=self.load_library
+        ).pack(side=tk.LEFT, padx=5)
+        
+        self.library_var = tk.StringVar()
+        self.library_combo = ttk.Combobox(
+            partners_controls,
+            textvariable=self.library_var,
+            state="readonly"
+        )
+        self.library_combo.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        self.library_combo.bind("<<ComboboxSelected>>", self.show_partners)
+        
+        self.partners_tree = ttk.Treeview(
+            partners_frame,
+            columns=("track", "score", "tempo", "key", "energy"),
+            show="headings",
+            height=6
+        )
+        self.partners_tree.heading("track", text="Track")
+        self.partners_tree.heading("score", text="Overall")
+        self.partners_tree.heading("tempo", text="Tempo")
+        self.partners_tree.heading("key", text="Key")
+        self.partners_tree.heading("energy", text="Energy")
+        
+        self.partners_tree.column("track", width=300)
+        self.partners_tree.column("score", width=80)
+        self.partners_tree.column("tempo", width=80)
+        self.partners_tree.column("key", width=80)
+        self.partners_tree.column("energy", width=80)
+        self.partners_tree.pack(fill=tk.BOTH, expand=True, pady=5)
+        
+        self.library_matrix = None
     
     def handle_drop(self, event):
         files = self.root.tk.splitlist(event.data)
@@ -368,7 +424,10 @@ class AudetGUI:
         for result in self.tree.get_children():
             if self.tree.item(result)["values"][0] == filename:
                 track_path = os.path.join(os.getcwd(), filename)
-                analysis = audet.analyze_audio(track_path)
+                # Only long mixes repay running the analyzers side by side
+                info = audet.probe_audio(track_path)
+                parallel = info is not None and info[0] >= audet.PARALLEL_MIN_DURATION
+                analysis = audet.analyze_audio(track_path, parallel=parallel)
                 
                 # Show details in a new window
                 details_window = tk.Toplevel(self.root)
@@ -427,7 +486,12 @@ class AudetGUI:
             return
         
         target_mood = self.mood_var.get()
-        playlist = audet.generate_playlist(files, target_mood)
+        energy_curve = self.curve_var.get()
+        playlist = audet.generate_playlist(
+            files,
+            target_mood,
+            energy_curve=None if energy_curve == "none" else energy_curve
+        )
         
         # Show playlist in a new window
         playlist_window = tk.Toplevel(self.root)
@@ -505,6 +569,51 @@ class AudetGUI:
         except Exception as e:
             messagebox.showerror("Error", f"Error analyzing compatibility: {str(e)}")
 
+    def load_library(self):
+        path = filedialog.askopenfilename(
+            title="Select Library Analysis",
+            filetypes=[
+                ("Analysis Results", "analysis.json *.json"),
+                ("Compatibility Matrix", "*.npz"),
+                ("All Files", "*.*")
+            ]
+        )
+        if not path:
+            return
+        
+        try:
+            if path.endswith('.npz'):
+                self.library_matrix = audet.load_compatibility_matrix(path)
+            else:
+                self.library_matrix = audet.compatibility_matrix(audet.load_results(path))
+        except Exception as e:
+            messagebox.showerror("Error", f"Error loading library: {str(e)}")
+            return
+        
+        self.library_combo["values"] = [os.path.basename(t) for t in self.library_matrix["tracks"]]
+        self.library_var.set("")
+        for item in self.partners_tree.get_children():
+            self.partners_tree.delete(item)
+    
+    def show_partners(self, event=None):
+        if self.library_matrix is None:
+            return
+        
+        index = self.library_combo.current()
+        matrix = self.library_matrix
+        
+        for item in self.partners_tree.get_children():
+            self.partners_tree.delete(item)
+        
+        for other, score in audet.top_partners(matrix, index, k=10):
+            self.partners_tree.insert("", tk.END, values=(
+                os.path.basename(matrix["tracks"][other]),
+                f"{score:.2f}",
+                f"{matrix['tempo_compatibility'][index, other]:.2f}",
+                "Yes" if matrix['key_compatibility'][index, other] else "No",
+                f"{matrix['energy_compatibility'][index, other]:.2f}"
+            ))
+
 def main():
     root = TkinterDnD.Tk()
     app = AudetGUI(root)